@@ -2,7 +2,7 @@ import os
 from setuptools import setup
 
 dependencies = ['parse>=1.6',
-                'tornado<4.3',
+                'tornado>=6.0',
                 'pyyaml>=3.0',
                 'pytz>=2016',
                 'python-dateutil>=2.5',
@@ -17,18 +17,21 @@ setup(
     description = ("Python 3 alternative to Logstash"),
     install_requires = dependencies,
     tests_require = test_dependencies,
+    extras_require = {'geoip': ['maxminddb>=1.2'],
+                      'uvloop': ['uvloop>=0.5']},
     packages=['stashpy'],
     package_data={'stashpy': ['patterns/grok_patterns.txt']},
     entry_points = {
-        'console_scripts': ['stashpy = stashpy.main:run']
+        'console_scripts': ['stashpy = stashpy.main:run',
+                            'stashpy-batch = stashpy.batch:run']
     },
     url = "https://github.com/afroisalreadyinu/stashpy",
     classifiers = [
         'Development Status :: 3 - Alpha',
         'License :: OSI Approved :: GNU General Public License (GPL)',
-        'Programming Language :: Python :: 3.4',
         'Programming Language :: Python :: 3.5',
         'Programming Language :: Python :: 3.6',
+        'Programming Language :: Python :: 3.7',
     ],
     keywords = 'logging elasticsearch kibana monitoring',
 )
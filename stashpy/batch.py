@@ -0,0 +1,330 @@
+"""Offline batch processing of log files, for backfilling archived logs.
+Input files are split into chunks that are parsed in parallel in a
+process pool, and the results are either written to NDJSON files or
+sent to ElasticSearch with bulk requests.
+
+Usage: stashpy-batch config.yml [options] file..."""
+import os
+import sys
+import gzip
+import json
+import time
+import logging
+import logging.config
+import argparse
+import itertools
+import collections
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+from urllib.request import urlopen, Request
+
+import yaml
+
+from stashpy import constants
+from .processor import load_processor, load_stages, make_document
+from .compression import Compressor
+from .indexer import index_name, document_ids, DEFAULT_INDEX_PATTERN, ID_AUTO
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_BYTES = 16 * 1024 * 1024
+DEFAULT_CHUNK_LINES = 100000
+DEFAULT_BULK_SIZE = 5000
+DEFAULT_CONCURRENCY = 4
+STDIN = '-'
+
+#set in each worker process by _init_worker
+_worker = {}
+
+
+def file_chunks(path, chunk_bytes=DEFAULT_CHUNK_BYTES):
+    """Split the file at path into (path, start, end) byte ranges. The
+    ranges are not aligned to lines; a line belongs to the chunk in which
+    it starts."""
+    size = os.path.getsize(path)
+    start = 0
+    while start < size:
+        end = min(start + chunk_bytes, size)
+        yield (path, start, end)
+        start = end
+
+
+def read_chunk(path, start, end):
+    """Return the offset of the first line that starts within [start, end)
+    of the file at path, and the lines that start in that range"""
+    lines = []
+    with open(path, 'rb') as infile:
+        if start > 0:
+            #skip the line that started in the previous chunk
+            infile.seek(start - 1)
+            infile.readline()
+        first = position = infile.tell()
+        while position < end:
+            line = infile.readline()
+            if not line:
+                break
+            lines.append(line)
+            position += len(line)
+    return first, lines
+
+
+def read_chunk_lines(path, start, end):
+    """Return the lines that start within [start, end) of the file at
+    path"""
+    return read_chunk(path, start, end)[1]
+
+
+def stream_chunks(infile, chunk_lines=DEFAULT_CHUNK_LINES):
+    """Split a file object that cannot be seeked, such as a gzip file or
+    stdin, into lists of lines"""
+    lines = []
+    for line in infile:
+        lines.append(line)
+        if len(lines) >= chunk_lines:
+            yield lines
+            lines = []
+    if lines:
+        yield lines
+
+
+def _init_worker(config, output_format, index_pattern, doc_type, bulk_size):
+    es_config = config.get('indexer_config') or {}
+    _worker['processor'] = load_processor(config.get('processor_spec'),
+                                          config.get('processor_class'))
+    _worker['syslog_header'] = config.get('syslog_header', False)
+    _worker['stages'] = load_stages(config)
+    _worker['format'] = output_format
+    _worker['index_pattern'] = index_pattern
+    _worker['doc_type'] = doc_type
+    _worker['bulk_size'] = bulk_size
+    _worker['document_id'] = document_ids(es_config.get('id_strategy', ID_AUTO))
+
+
+def _chunk_lines(chunk):
+    """Return the source, the lines of chunk, and the offsets of the lines,
+    byte offsets for files that can be seeked and line numbers
+    otherwise"""
+    if isinstance(chunk, list):
+        return STDIN, chunk, itertools.count()
+    path, start, rest = chunk
+    if isinstance(rest, list):
+        return path, rest, itertools.count(start)
+    first, lines = read_chunk(path, start, rest)
+    return path, lines, itertools.accumulate([first] + [len(line) for line in lines])
+
+
+def process_chunk(chunk):
+    """Parse the lines of a chunk, which is either a (path, start, end)
+    tuple, a (path, first line number, lines) tuple or a list of lines.
+    Returns the number of lines, the number of parsed lines, and a list of
+    output blocks: one NDJSON block, or one body per bulk request."""
+    source, lines, offsets = _chunk_lines(chunk)
+    processor = _worker['processor']
+    syslog_header = _worker['syslog_header']
+    stages = _worker['stages']
+    bulk = _worker['format'] == 'bulk'
+    parsed_count = 0
+    blocks, current = [], []
+    document_id = _worker['document_id']
+    for line, offset in zip(lines, offsets):
+        line = line.decode('utf-8', errors='replace').rstrip('\r\n')
+        doc, parsed = make_document(processor, line, syslog_header=syslog_header,
+                                    stages=stages)
+        parsed_count += parsed
+        if bulk:
+            action = {'_index': index_name(doc, _worker['index_pattern']),
+                      '_type': _worker['doc_type']}
+            doc_id = document_id((source, offset, line))
+            if doc_id is not None:
+                action['_id'] = doc_id
+            current.append(json.dumps({'index': action}))
+        else:
+            doc.pop('_index_', None)
+        current.append(json.dumps(doc))
+        if bulk and len(current) >= 2 * _worker['bulk_size']:
+            blocks.append('\n'.join(current) + '\n')
+            current = []
+    if current:
+        blocks.append('\n'.join(current) + '\n')
+    return len(lines), parsed_count, blocks
+
+
+class BulkSender:
+    """Sends bulk request bodies to ElasticSearch from a thread pool,
+    with at most concurrency requests in flight"""
+
+    def __init__(self, host, port, concurrency=DEFAULT_CONCURRENCY, compression=None):
+        self.url = 'http://{}:{}/_bulk'.format(host.rstrip('/'), port)
+        #bodies are compressed in the sending threads
+        self.compressor = Compressor(compression) if compression else None
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+        self.slots = threading.BoundedSemaphore(concurrency)
+        self.failed = 0
+        self.lock = threading.Lock()
+
+    def _post(self, body):
+        try:
+            data = body.encode('utf-8')
+            headers = {'Content-Type': 'application/x-ndjson'}
+            if self.compressor is not None:
+                data, encoding_headers = self.compressor.compress(data)
+                headers.update(encoding_headers)
+            request = Request(self.url, data=data, method='POST', headers=headers)
+            response = json.loads(urlopen(request).read().decode('utf-8'))
+            if response.get('errors'):
+                failed = sum(1 for item in response['items']
+                             if not 200 <= list(item.values())[0].get('status', 500) < 300)
+                with self.lock:
+                    self.failed += failed
+        except Exception:
+            logger.exception("Bulk request failed")
+            with self.lock:
+                self.failed += body.count('\n') // 2
+        finally:
+            self.slots.release()
+
+    def send(self, body):
+        self.slots.acquire()
+        self.executor.submit(self._post, body)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        if self.compressor is not None and self.compressor.compressed:
+            logger.info("Compressed %(compressed)d bulk bodies, ratio: %(ratio).2f, "
+                        "mean compression time: %(mean_compress_ms).2f ms",
+                        self.compressor.stats())
+
+
+class NDJSONWriter:
+    """Writes the output for each input file to an NDJSON file of the
+    same name in a directory"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.outfile = None
+
+    def start(self, input_path):
+        self.close()
+        name = 'stdin' if input_path == STDIN else os.path.basename(input_path)
+        if name.endswith('.gz'):
+            name = name[:-3]
+        self.outfile = open(os.path.join(self.directory, name + '.ndjson'), 'w')
+
+    def send(self, block):
+        self.outfile.write(block)
+
+    def close(self):
+        if self.outfile is not None:
+            self.outfile.close()
+            self.outfile = None
+
+
+def _numbered_chunks(path, infile, chunk_lines):
+    line_number = 0
+    for lines in stream_chunks(infile, chunk_lines):
+        yield (path, line_number, lines)
+        line_number += len(lines)
+
+
+def input_chunks(path, chunk_bytes, chunk_lines):
+    if path == STDIN:
+        yield from _numbered_chunks(path, sys.stdin.buffer, chunk_lines)
+    elif path.endswith('.gz'):
+        with gzip.open(path, 'rb') as infile:
+            yield from _numbered_chunks(path, infile, chunk_lines)
+    else:
+        yield from file_chunks(path, chunk_bytes)
+
+
+def ordered_results(pool, chunks, window):
+    """Like pool.imap(process_chunk, chunks), but with at most window
+    chunks read and in processing at a time, so that memory use is
+    bounded for streamed input"""
+    pending = collections.deque()
+    for chunk in chunks:
+        pending.append(pool.apply_async(process_chunk, (chunk,)))
+        if len(pending) >= window:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+
+def backfill(config, paths, output=None, workers=None,
+             chunk_bytes=DEFAULT_CHUNK_BYTES, chunk_lines=DEFAULT_CHUNK_LINES,
+             bulk_size=DEFAULT_BULK_SIZE, concurrency=DEFAULT_CONCURRENCY):
+    """Process the files at paths with a pool of workers, writing NDJSON
+    files to the directory output if it is given, and indexing on the
+    cluster in config['indexer_config'] otherwise. Returns the number of
+    lines processed."""
+    es_config = config.get('indexer_config') or {}
+    if output is not None:
+        sink = NDJSONWriter(output)
+        output_format = 'ndjson'
+    else:
+        if not es_config:
+            raise ValueError("Either an output directory or indexer_config is required")
+        sink = BulkSender(es_config['host'], es_config['port'], concurrency,
+                          compression=es_config.get('compression'))
+        output_format = 'bulk'
+    init_args = (config, output_format,
+                 es_config.get('index_pattern', DEFAULT_INDEX_PATTERN),
+                 es_config.get('doc_type', 'doc'), bulk_size)
+    started = time.time()
+    total_lines = total_parsed = 0
+    workers = workers or os.cpu_count() or 1
+    with multiprocessing.Pool(workers, initializer=_init_worker, initargs=init_args) as pool:
+        for path in paths:
+            if output_format == 'ndjson':
+                sink.start(path)
+            chunks = input_chunks(path, chunk_bytes, chunk_lines)
+            for lines, parsed, blocks in ordered_results(pool, chunks, 2 * workers):
+                for block in blocks:
+                    sink.send(block)
+                total_lines += lines
+                total_parsed += parsed
+                elapsed = time.time() - started
+                logger.info("Processed %d lines, %.0f lines/sec",
+                            total_lines, total_lines / elapsed if elapsed else 0)
+    sink.close()
+    elapsed = time.time() - started
+    logger.info("Done: %d lines, %d parsed, in %.1f secs (%.0f lines/sec)",
+                total_lines, total_parsed, elapsed,
+                total_lines / elapsed if elapsed else 0)
+    if output_format == 'bulk' and sink.failed:
+        logger.warning("%d documents could not be indexed", sink.failed)
+    return total_lines
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog='stashpy-batch',
+                                     description='Parse log files in parallel')
+    parser.add_argument('config', help='Stashpy configuration file')
+    parser.add_argument('files', nargs='+',
+                        help='Log files to process, optionally gzipped; - for stdin')
+    parser.add_argument('-o', '--output',
+                        help='Write NDJSON files to this directory instead of indexing')
+    parser.add_argument('-w', '--workers', type=int, default=None,
+                        help='Number of worker processes; number of CPUs by default')
+    parser.add_argument('--chunk-bytes', type=int, default=DEFAULT_CHUNK_BYTES)
+    parser.add_argument('--chunk-lines', type=int, default=DEFAULT_CHUNK_LINES)
+    parser.add_argument('--bulk-size', type=int, default=DEFAULT_BULK_SIZE,
+                        help='Documents per bulk request')
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                        help='Maximum number of bulk requests in flight')
+    return parser.parse_args(argv)
+
+
+def run():
+    args = parse_args(sys.argv[1:])
+    with open(os.path.abspath(args.config), 'r') as config_file:
+        config = yaml.safe_load(config_file)
+    logging.config.dictConfig(config.pop('logging', constants.DEFAULT_LOGGING))
+    try:
+        backfill(config, args.files, output=args.output, workers=args.workers,
+                 chunk_bytes=args.chunk_bytes, chunk_lines=args.chunk_lines,
+                 bulk_size=args.bulk_size, concurrency=args.concurrency)
+    except:
+        logging.exception('Exception: ')
+        raise
@@ -0,0 +1,104 @@
+"""Compression of the bodies of requests sent to ElasticSearch, to save
+bandwidth when the cluster is far away. Compression runs in a thread
+pool, so that it does not hold up the IOLoop; zlib releases the GIL
+while compressing."""
+import gzip
+import zlib
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import tornado.ioloop
+
+logger = logging.getLogger(__name__)
+
+GZIP = 'gzip'
+DEFLATE = 'deflate'
+ENCODINGS = (GZIP, DEFLATE)
+DEFAULT_LEVEL = 6
+DEFAULT_MIN_BYTES = 1024
+DEFAULT_THREADS = 1
+DEFAULT_REPORT_COUNT = 10000
+
+
+def compress(data, encoding, level=DEFAULT_LEVEL):
+    if encoding == GZIP:
+        return gzip.compress(data, level)
+    if encoding == DEFLATE:
+        #the deflate content coding is the zlib format
+        return zlib.compress(data, level)
+    raise ValueError("Unknown encoding {}".format(encoding))
+
+
+class Compressor:
+    """Compresses request bodies that are at least min_bytes long with
+    encoding, and keeps track of how much was saved at what cost"""
+
+    def __init__(self, config):
+        if isinstance(config, str):
+            config = {'encoding': config}
+        self.encoding = config.get('encoding', GZIP)
+        if self.encoding not in ENCODINGS:
+            raise ValueError("Unknown encoding {}".format(self.encoding))
+        self.level = config.get('level', DEFAULT_LEVEL)
+        self.min_bytes = config.get('min_bytes', DEFAULT_MIN_BYTES)
+        self.threads = config.get('threads', DEFAULT_THREADS)
+        self.report_count = config.get('report_count', DEFAULT_REPORT_COUNT)
+        self._executor = None
+        self.lock = threading.Lock()
+        self.compressed = 0
+        self.raw_bytes = 0
+        self.compressed_bytes = 0
+        self.compress_time = 0.0
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.threads)
+        return self._executor
+
+    def compress(self, body):
+        """Return body, compressed if it is long enough, and the headers
+        to send with it"""
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        if len(body) < self.min_bytes:
+            return body, {}
+        started = time.perf_counter()
+        compressed = compress(body, self.encoding, self.level)
+        elapsed = time.perf_counter() - started
+        with self.lock:
+            self.compressed += 1
+            self.raw_bytes += len(body)
+            self.compressed_bytes += len(compressed)
+            self.compress_time += elapsed
+            report = self.compressed % self.report_count == 0
+        if report:
+            logger.info("Compressed %(compressed)d request bodies, ratio: %(ratio).2f, "
+                        "mean compression time: %(mean_compress_ms).2f ms", self.stats())
+        return compressed, {'Content-Encoding': self.encoding}
+
+    async def compress_async(self, body):
+        """Like compress, but in the thread pool for bodies that will be
+        compressed"""
+        if len(body) < self.min_bytes:
+            return (body.encode('utf-8') if isinstance(body, str) else body), {}
+        return await tornado.ioloop.IOLoop.current().run_in_executor(
+            self.executor, self.compress, body)
+
+    def stats(self):
+        """Return the number of compressed bodies, the ratio of compressed
+        to uncompressed bytes, and the mean compression time in
+        milliseconds"""
+        with self.lock:
+            return {'compressed': self.compressed,
+                    'ratio': (self.compressed_bytes / self.raw_bytes
+                              if self.raw_bytes else 1.0),
+                    'mean_compress_ms': (self.compress_time / self.compressed * 1000
+                                         if self.compressed else 0.0)}
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
@@ -0,0 +1,36 @@
+"""Choice of the event loop Stashpy runs on. Tornado's IOLoop always
+runs on an asyncio event loop; by default, this is the one of the
+default asyncio policy. Alternatively, it can be the event loop of
+uvloop, or of any other asyncio event loop policy given by its dotted
+path."""
+import asyncio
+import importlib
+
+import tornado.ioloop
+
+TORNADO = 'tornado'
+ASYNCIO = 'asyncio'
+UVLOOP = 'uvloop'
+
+
+def _policy_class(dotted_path):
+    module_name, class_name = dotted_path.rsplit('.', 1)
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def install_event_loop(name=None):
+    """Make a new event loop of the kind called name the current one, and
+    return the IOLoop running on it. This has to be done before anything
+    uses the IOLoop. tornado is the same as asyncio, as the IOLoop has
+    no event loop of its own since Tornado 5."""
+    if name == UVLOOP:
+        try:
+            import uvloop
+        except ImportError:
+            raise RuntimeError("The uvloop package is required for the uvloop event "
+                               "loop; install it with pip install stashpy[uvloop]")
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    elif name not in (None, TORNADO, ASYNCIO):
+        asyncio.set_event_loop_policy(_policy_class(name)())
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    return tornado.ioloop.IOLoop.current()
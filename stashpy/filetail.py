@@ -0,0 +1,250 @@
+"""File input, for hosts that cannot run a log shipper. Tails files
+matching the configured glob patterns, and remembers how far each file
+was read in a checkpoint file, so that a restarted Stashpy continues
+where it stopped."""
+import os
+import glob
+import json
+import logging
+
+from tornado import gen
+import tornado.ioloop
+
+from .framing import LineFramer, DEFAULT_MAX_LINE_BYTES
+from .processor import make_document
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_POLL_INTERVAL = 1
+DEFAULT_READ_SIZE = 1024 * 1024
+DEFAULT_BATCH_SIZE = 500
+START_AT_BEGINNING = 'beginning'
+START_AT_END = 'end'
+
+
+class TailedFile:
+    """A file that is being tailed. The file is identified by its inode, as
+    its path changes when it is rotated; source is the path and inode it
+    was first tailed under, which identifies it in document keys."""
+
+    __slots__ = ('path', 'fd', 'inode', 'offset', 'framer', 'source')
+
+    def __init__(self, path, fd, inode, offset, max_line_bytes, source=None):
+        self.path = path
+        self.fd = fd
+        self.inode = inode
+        self.offset = offset
+        self.framer = LineFramer(max_line_bytes, offset=offset)
+        self.source = source or '{}:{}'.format(path, inode)
+
+    @property
+    def processed_offset(self):
+        """The offset up to which all lines have been processed"""
+        return self.offset - self.framer.buffered
+
+    def read(self, read_size):
+        data = os.pread(self.fd, read_size, self.offset)
+        self.offset += len(data)
+        return data
+
+    def rewind(self):
+        self.offset = 0
+        self.framer.release()
+        self.framer.offset = 0
+
+    def close(self):
+        os.close(self.fd)
+        self.fd = None
+
+
+class FileTailer:
+
+    def __init__(self, config, indexer, line_processor, io_loop=None, syslog_header=False,
+                 stages=()):
+        self.patterns = config['paths']
+        if isinstance(self.patterns, str):
+            self.patterns = [self.patterns]
+        self.checkpoint_path = config.get('checkpoint_path')
+        self.poll_interval = config.get('poll_interval', DEFAULT_POLL_INTERVAL)
+        self.start_position = config.get('start_position', START_AT_END)
+        assert self.start_position in (START_AT_BEGINNING, START_AT_END)
+        self.read_size = config.get('read_size', DEFAULT_READ_SIZE)
+        self.batch_size = config.get('batch_size', DEFAULT_BATCH_SIZE)
+        self.max_line_bytes = config.get('max_line_bytes', DEFAULT_MAX_LINE_BYTES)
+        self.indexer = indexer
+        self.line_processor = line_processor
+        self.syslog_header = syslog_header
+        self.stages = stages
+        self.io_loop = io_loop or tornado.ioloop.IOLoop.current()
+        self.files = {}
+        #whether this is a restart, in which case files without a checkpoint
+        #were created while Stashpy was down, and are read in full
+        self.resumed = bool(self.checkpoint_path) and os.path.exists(self.checkpoint_path)
+        self.checkpoints = self.load_checkpoints()
+        self.first_poll = True
+        self.polling = False
+        self.poller = None
+        self.lines = 0
+
+    def load_checkpoints(self):
+        """Return a dictionary of inode to the saved offset and source"""
+        if not self.checkpoint_path or not os.path.exists(self.checkpoint_path):
+            return {}
+        with open(self.checkpoint_path, 'r') as checkpoint_file:
+            saved = json.load(checkpoint_file)
+        return {entry['inode']: (entry['offset'], entry.get('source'))
+                for entry in saved.values()}
+
+    def save_checkpoints(self):
+        if not self.checkpoint_path:
+            return
+        saved = {path: {'inode': tailed.inode, 'offset': tailed.processed_offset,
+                        'source': tailed.source}
+                 for path, tailed in self.files.items()}
+        temp_path = self.checkpoint_path + '.tmp'
+        with open(temp_path, 'w') as checkpoint_file:
+            json.dump(saved, checkpoint_file)
+        os.replace(temp_path, self.checkpoint_path)
+
+    def start(self):
+        self.poller = tornado.ioloop.PeriodicCallback(
+            self._poll_callback, self.poll_interval * 1000)
+        self.poller.start()
+        self.io_loop.add_callback(self._poll_callback)
+        logger.info("Tailing files matching %s", ', '.join(self.patterns))
+
+    def stop(self):
+        if self.poller is not None:
+            self.poller.stop()
+        for tailed in self.files.values():
+            tailed.close()
+        self.files = {}
+
+    def _poll_callback(self):
+        if not self.polling:
+            self.io_loop.add_future(gen.convert_yielded(self.poll()), self._poll_done)
+
+    def _poll_done(self, future):
+        if future.exception() is not None:
+            logger.error("Error tailing files: %s", future.exception())
+
+    def _open(self, path, stat):
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError as exc:
+            logger.warning("Cannot open %s: %s", path, exc)
+            return None
+        source = None
+        if stat.st_ino in self.checkpoints:
+            offset, source = self.checkpoints.pop(stat.st_ino)
+        elif (self.first_poll and not self.resumed and
+              self.start_position == START_AT_END):
+            offset = stat.st_size
+        else:
+            offset = 0
+        if offset > stat.st_size:
+            offset = 0
+        logger.info("Started tailing %s at offset %d", path, offset)
+        return TailedFile(path, fd, stat.st_ino, offset, self.max_line_bytes, source=source)
+
+    def matching_paths(self):
+        paths = set()
+        for pattern in self.patterns:
+            paths.update(glob.glob(pattern))
+        return paths
+
+    def _stat_paths(self):
+        """Return a dictionary of the matching paths to their stat"""
+        stats = {}
+        for path in self.matching_paths():
+            try:
+                stats[path] = os.stat(path)
+            except FileNotFoundError:
+                pass
+        return stats
+
+    async def poll(self):
+        self.polling = True
+        try:
+            stats = self._stat_paths()
+            await self._follow_renames(stats)
+            for path, stat in stats.items():
+                tailed = self.files.get(path)
+                if tailed is None:
+                    tailed = self._open(path, stat)
+                    if tailed is not None:
+                        self.files[path] = tailed
+                elif stat.st_size < tailed.offset:
+                    logger.info("%s was truncated, reading from the start", path)
+                    tailed.rewind()
+            #files that were already tailed come first, so that the rest of
+            #a rotated file is read before the file that replaced it
+            for tailed in list(self.files.values()):
+                await self.read_file(tailed)
+            self.first_poll = False
+        finally:
+            self.polling = False
+
+    async def _follow_renames(self, stats):
+        """Move the tailed files that were renamed to their new paths, and
+        read what was left in those that no longer match, i.e. that were
+        rotated away or deleted, before closing them"""
+        paths = {stat.st_ino: path for path, stat in stats.items()}
+        files = {}
+        gone = []
+        for path, tailed in self.files.items():
+            new_path = paths.get(tailed.inode)
+            if new_path is None:
+                gone.append(tailed)
+                continue
+            if new_path != path:
+                logger.info("%s was renamed to %s", path, new_path)
+                tailed.path = new_path
+            files[new_path] = tailed
+        self.files = files
+        for tailed in gone:
+            await self.read_file(tailed, final=True)
+            tailed.close()
+            logger.info("%s was rotated", tailed.path)
+        if gone:
+            self.save_checkpoints()
+
+    async def read_file(self, tailed, final=False):
+        batch = []
+        progressed = False
+        source = tailed.source
+        while True:
+            data = tailed.read(self.read_size)
+            if not data:
+                break
+            progressed = True
+            #the offsets at which the lines start, used in document keys
+            starts = []
+            lines = tailed.framer.feed(data, starts)
+            for (line, truncated), line_offset in zip(lines, starts):
+                batch.append((line, truncated, (source, line_offset)))
+                if len(batch) >= self.batch_size:
+                    await self.process_batch(batch)
+                    batch = []
+        if final:
+            line_offset = tailed.framer.offset
+            remaining = tailed.framer.flush()
+            if remaining is not None:
+                batch.append(remaining + ((source, line_offset),))
+        if batch:
+            await self.process_batch(batch)
+        if progressed:
+            self.save_checkpoints()
+
+    async def process_batch(self, batch):
+        docs = []
+        for line, truncated, (source, offset) in batch:
+            line = line.decode('utf-8', errors='replace')
+            doc, parsed = make_document(self.line_processor, line,
+                                        syslog_header=self.syslog_header,
+                                        stages=self.stages)
+            if truncated:
+                doc['truncated'] = True
+            docs.append((doc, (source, offset, line)))
+        self.lines += len(docs)
+        await gen.multi([self.indexer.index(doc, key=key) for doc, key in docs])
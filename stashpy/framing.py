@@ -0,0 +1,106 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_LINE_BYTES = 64 * 1024
+DEFAULT_MAX_BUFFER_BYTES = 1024 * 1024
+DEFAULT_MAX_TOTAL_BUFFER_BYTES = 256 * 1024 * 1024
+
+
+class BufferBudget:
+    """Keeps track of the bytes buffered by all connections, so that the
+    total can be capped."""
+
+    def __init__(self, maximum=DEFAULT_MAX_TOTAL_BUFFER_BYTES):
+        self.maximum = maximum
+        self.total = 0
+
+    def adjust(self, delta):
+        self.total += delta
+
+
+class LineFramer:
+    """Splits a byte stream into newline-terminated lines, keeping at most
+    max_line_bytes of any line in memory. Lines longer than that are cut
+    at max_line_bytes and returned with the truncated flag set; the rest
+    of the line is discarded as it arrives. offset is the position in the
+    stream of the start of the buffer, i.e. the number of bytes returned
+    or discarded so far, plus the offset the stream started at."""
+
+    __slots__ = ('max_line_bytes', 'budget', 'buffer', 'discarding', 'peak_buffered',
+                 'offset')
+
+    def __init__(self, max_line_bytes=DEFAULT_MAX_LINE_BYTES, budget=None, offset=0):
+        self.max_line_bytes = max_line_bytes
+        self.budget = budget
+        self.buffer = bytearray()
+        self.discarding = False
+        self.peak_buffered = 0
+        self.offset = offset
+
+    @property
+    def buffered(self):
+        return len(self.buffer)
+
+    def feed(self, data, starts=None):
+        """Add data to the buffer, and return a list of (line, truncated)
+        tuples for the lines that are complete or too long. If starts is a
+        list, the stream offset at which each of the lines starts is
+        appended to it."""
+        before = len(self.buffer)
+        lines = []
+        start = 0
+        buf = self.buffer
+        buf.extend(data)
+        while True:
+            pos = buf.find(b'\n', start)
+            if pos == -1:
+                break
+            if self.discarding:
+                self.discarding = False
+            else:
+                lines.append(self._cut(buf, start, pos))
+                if starts is not None:
+                    starts.append(self.offset + start)
+            start = pos + 1
+        del buf[:start]
+        self.offset += start
+        if self.discarding:
+            self.offset += len(buf)
+            buf.clear()
+        elif len(buf) > self.max_line_bytes or (buf and self._over_budget(before)):
+            lines.append(self._cut(buf, 0, len(buf), force_truncate=True))
+            if starts is not None:
+                starts.append(self.offset)
+            self.offset += len(buf)
+            buf.clear()
+            self.discarding = True
+        self.peak_buffered = max(self.peak_buffered, before + len(data))
+        if self.budget is not None:
+            self.budget.adjust(len(buf) - before)
+        return lines
+
+    def _over_budget(self, before):
+        if self.budget is None or self.budget.maximum is None:
+            return False
+        return self.budget.total + len(self.buffer) - before > self.budget.maximum
+
+    def _cut(self, buf, start, end, force_truncate=False):
+        if end - start > self.max_line_bytes:
+            return bytes(buf[start:start + self.max_line_bytes]), True
+        return bytes(buf[start:end]), force_truncate
+
+    def flush(self):
+        """Return whatever is left in the buffer as a final line, or None if
+        there is nothing left."""
+        remaining = bytes(self.buffer)
+        self.release()
+        if not remaining:
+            return None
+        return remaining, False
+
+    def release(self):
+        if self.budget is not None:
+            self.budget.adjust(-len(self.buffer))
+        self.buffer = bytearray()
+        self.discarding = False
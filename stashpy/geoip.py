@@ -0,0 +1,117 @@
+"""GeoIP enrichment from a local MaxMind database file (GeoLite2 or
+GeoIP2 City/Country in the MMDB format). The database is memory-mapped,
+and lookups are cached, as client IPs tend to repeat a lot."""
+import time
+import logging
+import functools
+
+try:
+    import maxminddb
+except ImportError:
+    maxminddb = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CACHE_SIZE = 10000
+DEFAULT_TARGET = 'geoip'
+DEFAULT_REPORT_COUNT = 100000
+
+
+def open_database(path):
+    if maxminddb is None:
+        raise RuntimeError("The maxminddb package is required for GeoIP lookups; "
+                           "install it with pip install stashpy[geoip]")
+    return maxminddb.open_database(path, maxminddb.MODE_MMAP)
+
+
+def _name(record):
+    names = record.get('names')
+    if names:
+        return names.get('en')
+    return None
+
+
+def to_fields(ip, record):
+    """Turn a MaxMind record into the fields of the geoip object in the
+    index template"""
+    fields = {'ip': ip}
+    location = record.get('location')
+    if location and 'latitude' in location and 'longitude' in location:
+        fields['latitude'] = location['latitude']
+        fields['longitude'] = location['longitude']
+        fields['location'] = [location['longitude'], location['latitude']]
+        if 'time_zone' in location:
+            fields['timezone'] = location['time_zone']
+    country = record.get('country')
+    if country:
+        fields['country_code2'] = country.get('iso_code')
+        fields['country_name'] = _name(country)
+    continent = record.get('continent')
+    if continent:
+        fields['continent_code'] = continent.get('code')
+    city = record.get('city')
+    if city:
+        fields['city_name'] = _name(city)
+    subdivisions = record.get('subdivisions')
+    if subdivisions:
+        fields['region_name'] = _name(subdivisions[0])
+    postal = record.get('postal')
+    if postal:
+        fields['postal_code'] = postal.get('code')
+    return {key: value for key, value in fields.items() if value is not None}
+
+
+class GeoIPStage:
+    """Adds the location of the IP in the first of the configured fields
+    that has one to documents"""
+
+    def __init__(self, config, reader=None):
+        fields = config.get('fields', config.get('field', 'clientip'))
+        self.fields = [fields] if isinstance(fields, str) else fields
+        self.target = config.get('target', DEFAULT_TARGET)
+        self.reader = reader or open_database(config['database'])
+        self.report_count = config.get('report_count', DEFAULT_REPORT_COUNT)
+        self.lookup = functools.lru_cache(
+            maxsize=config.get('cache_size', DEFAULT_CACHE_SIZE))(self._lookup)
+        self.lookups = 0
+        self.lookup_time = 0.0
+        self.db_lookups = 0
+
+    def _lookup(self, ip):
+        started = time.perf_counter()
+        try:
+            record = self.reader.get(ip)
+        except (ValueError, TypeError):
+            record = None
+        self.db_lookups += 1
+        self.lookup_time += time.perf_counter() - started
+        if record is None:
+            return None
+        return to_fields(ip, record)
+
+    def stats(self):
+        """Return the number of lookups, the cache hit rate, and the mean
+        time of a database lookup in microseconds"""
+        info = self.lookup.cache_info()
+        total = info.hits + info.misses
+        return {'lookups': total,
+                'hit_rate': info.hits / total if total else 0.0,
+                'mean_db_lookup_us': (self.lookup_time / self.db_lookups * 1e6
+                                      if self.db_lookups else 0.0)}
+
+    def __call__(self, doc):
+        for field in self.fields:
+            ip = doc.get(field)
+            #decoded JSON can have any type, and lookups are cached by value
+            if not ip or not isinstance(ip, str):
+                continue
+            fields = self.lookup(ip)
+            self.lookups += 1
+            if self.lookups % self.report_count == 0:
+                logger.info("GeoIP lookups: %(lookups)d, cache hit rate: %(hit_rate).2f, "
+                            "mean database lookup: %(mean_db_lookup_us).1f us",
+                            self.stats())
+            if fields is not None:
+                doc[self.target] = dict(fields)
+                return doc
+        return doc
@@ -1,17 +1,26 @@
-import importlib
 import logging
-from datetime import datetime
-import pytz
+from uuid import uuid4
 
 from tornado import gen
+import tornado.ioloop
 import tornado.tcpserver
 
-from .indexer import ESIndexer
-from .processor import LineProcessor
+from .indexer import ESIndexer, build_template, template_name, DEFAULT_INDEX_PATTERN
+from .processor import load_processor, load_stages, make_document
+from .scheduling import Scheduler
+from .shedding import LoadShedder
+from .sinks import load_outputs
+from .multiline import MultilineSpec
+from .syslog import FIELD_TYPES as SYSLOG_FIELD_TYPES
+from .framing import (LineFramer, BufferBudget, DEFAULT_MAX_LINE_BYTES,
+                      DEFAULT_MAX_BUFFER_BYTES, DEFAULT_MAX_TOTAL_BUFFER_BYTES)
 
 logger = logging.getLogger(__name__)
 
 class RotatingCounter:
+
+    __slots__ = ('maximum', 'log_message', 'logger', 'current')
+
     def __init__(self, maximum, log_message, logger_arg=None):
         self.maximum = maximum
         self.log_message = log_message
@@ -28,13 +37,48 @@ class RotatingCounter:
         self.logger.info(self.log_message, self.maximum)
 
 
+NEWLINE_FRAMING = 'newline'
+OCTET_COUNTED_FRAMING = 'octet_counted'
+#enough for a length in the gigabytes
+MAX_FRAME_HEADER_BYTES = 12
+
+def _log_exception(future):
+    if future.exception() is not None:
+        logger.error("Error indexing line: %s", future.exception())
+
+
 class ConnectionHandler:
 
-    def __init__(self, stream, address, indexer, line_processor, heartbeat_count=10):
+    __slots__ = ('stream', 'address', 'indexer', 'line_processor', 'framer',
+                 'unparsed_counter', 'parsed_counter', 'idle_timeout',
+                 'last_activity', '_idle_handle', 'quota', 'framing', 'syslog_header',
+                 'multiline', '_flush_handle', 'stages', 'source', 'line_number',
+                 'shedder')
+
+    def __init__(self, stream, address, indexer, line_processor, heartbeat_count=10,
+                 max_line_bytes=DEFAULT_MAX_LINE_BYTES, budget=None, idle_timeout=None,
+                 quota=None, framing=NEWLINE_FRAMING, syslog_header=False,
+                 multiline=None, stages=(), shedder=None):
         self.stream = stream
         self.address = address
         self.indexer = indexer
         self.line_processor = line_processor
+        self.framer = LineFramer(max_line_bytes, budget=budget)
+        self.idle_timeout = idle_timeout
+        self.last_activity = None
+        self._idle_handle = None
+        self.quota = quota
+        assert framing in (NEWLINE_FRAMING, OCTET_COUNTED_FRAMING)
+        self.framing = framing
+        self.syslog_header = syslog_header
+        self.multiline = multiline.aggregator() if multiline is not None else None
+        self._flush_handle = None
+        self.stages = stages
+        #identifies this connection in document keys, as the address can be
+        #None, and line numbers start over when a client reconnects
+        self.source = '{} {}'.format(address, uuid4().hex)
+        self.line_number = 0
+        self.shedder = shedder
         self.unparsed_counter = RotatingCounter(
             heartbeat_count,
             "Indexed %d unparsed documents")
@@ -44,49 +88,196 @@ class ConnectionHandler:
         self.stream.set_close_callback(self.on_close)
         logger.info("Accepted connection from {}".format(address))
 
-    @gen.coroutine
-    def on_connect(self):
-        yield self.dispatch_client()
+    async def on_connect(self):
+        if self.idle_timeout:
+            self.last_activity = self.stream.io_loop.time()
+            self._schedule_idle_check()
+        try:
+            await self.dispatch_client()
+        finally:
+            self.teardown()
+
+    def _schedule_idle_check(self):
+        self._idle_handle = self.stream.io_loop.call_at(
+            self.last_activity + self.idle_timeout, self._check_idle)
+
+    def _check_idle(self):
+        self._idle_handle = None
+        if self.stream is None or self.stream.closed():
+            return
+        if self.stream.io_loop.time() - self.last_activity >= self.idle_timeout:
+            logger.info("Connection to %s idle for %d seconds, closing",
+                        self.address, self.idle_timeout)
+            self.stream.close()
+        else:
+            self._schedule_idle_check()
 
-    @gen.coroutine
-    def dispatch_client(self):
+    async def dispatch_client(self):
         try:
-            while True:
-                line = yield self.stream.read_until(b"\n")
-                yield self.process_line(line)
+            if self.framing == OCTET_COUNTED_FRAMING:
+                await self.read_frames()
+            else:
+                await self.read_lines()
         except tornado.iostream.StreamClosedError:
             pass
+        except tornado.iostream.UnsatisfiableReadError:
+            logger.error("Frame header from %s too long, closing connection", self.address)
+            self.stream.close()
+        remaining = self.framer.flush()
+        if remaining is not None:
+            await self.process_line(*remaining)
+        if self.multiline is not None:
+            event = self.multiline.flush()
+            if event is not None:
+                await self.index_line(*event)
 
-    @gen.coroutine
-    def process_line(self, line):
-        line = line.decode('utf-8').rstrip('\n')
+    async def read_lines(self):
+        while True:
+            chunk = await self.stream.read_bytes(self.stream.read_chunk_size,
+                                                 partial=True)
+            self._touch()
+            for line, truncated in self.framer.feed(chunk):
+                await self.process_line(line, truncated=truncated)
+                wait = self._turn_wait()
+                if wait is not None:
+                    await gen.sleep(wait)
+
+    async def read_frames(self):
+        """Read octet-counted frames as described in RFC 6587, i.e. the
+        length of the message in ASCII digits, a space, and the message"""
+        max_line_bytes = self.framer.max_line_bytes
+        while True:
+            length = await self.stream.read_until(b' ', max_bytes=MAX_FRAME_HEADER_BYTES)
+            try:
+                length = int(length)
+            except ValueError:
+                length = None
+            if length is None or length <= 0:
+                logger.error("Invalid frame length from %s, closing connection",
+                             self.address)
+                self.stream.close()
+                return
+            self._touch()
+            if length <= max_line_bytes:
+                frame = await self.stream.read_bytes(length)
+                await self.process_line(frame)
+            else:
+                frame = await self.stream.read_bytes(max_line_bytes)
+                await self._skip(length - max_line_bytes)
+                await self.process_line(frame, truncated=True)
+            wait = self._turn_wait()
+            if wait is not None:
+                await gen.sleep(wait)
+
+    async def _skip(self, count):
+        """Read and discard count bytes, a chunk at a time so that they are
+        never buffered in full"""
+        while count:
+            chunk = await self.stream.read_bytes(min(count, self.stream.read_chunk_size),
+                                                 partial=True)
+            count -= len(chunk)
+
+    def _touch(self):
+        if self.idle_timeout:
+            self.last_activity = self.stream.io_loop.time()
+
+    def _turn_wait(self):
+        if self.quota is None:
+            return None
+        return self.quota.charge(self.stream.io_loop.time())
+
+    def buffered_bytes(self):
+        """Bytes currently held in memory for this connection, both in the
+        stream's read buffer and in the partial line"""
+        if self.stream is None:
+            return 0
+        return self.stream._read_buffer_size + self.framer.buffered
+
+    async def process_line(self, line, truncated=False):
+        """Index the line, or add it to the current multi-line event"""
+        line = line.decode('utf-8', errors='replace').rstrip('\n')
         logger.debug("New line: %s", line)
-        result = self.line_processor.for_line(line)
-        if result is None:
-            logger.debug("Line not parsed, storing whole message")
-            result = {'message': line, '@version': 1}
-            self.unparsed_counter.inc()
-        else:
-            logger.debug("Match: %s", str(result))
-            result['message'] = line
-            result['@version'] = 1
+        if self.multiline is None:
+            await self.index_line(line, truncated)
+            return
+        for event, event_truncated in self.multiline.feed(
+                line, truncated, now=self.stream.io_loop.time()):
+            await self.index_line(event, event_truncated)
+        if self.multiline.pending and self._flush_handle is None:
+            self._schedule_flush()
+
+    def _schedule_flush(self):
+        self._flush_handle = self.stream.io_loop.call_at(
+            self.multiline.last_update + self.multiline.spec.flush_timeout,
+            self._flush_multiline)
+
+    def _flush_multiline(self):
+        """Index the current multi-line event if no lines were added to it
+        for flush_timeout seconds"""
+        self._flush_handle = None
+        if self.multiline is None or not self.multiline.pending:
+            return
+        io_loop = self.stream.io_loop
+        if io_loop.time() - self.multiline.last_update < self.multiline.spec.flush_timeout:
+            self._schedule_flush()
+            return
+        event = self.multiline.flush()
+        io_loop.add_future(gen.convert_yielded(self.index_line(*event)), _log_exception)
+
+    async def index_line(self, line, truncated=False):
+        """Make a document out of line and index it"""
+        result, parsed = make_document(self.line_processor, line,
+                                       syslog_header=self.syslog_header,
+                                       stages=self.stages)
+        if parsed:
             self.parsed_counter.inc()
-        if '@timestamp' not in result:
-            result['@timestamp'] = datetime.utcnow().replace(tzinfo=pytz.utc).isoformat()
-        yield self.indexer.index(result)
+        else:
+            self.unparsed_counter.inc()
+        if truncated:
+            logger.info("Line from %s truncated", self.address)
+            result['truncated'] = True
+        self.line_number += 1
+        if self.shedder is None:
+            await self.indexer.index(result, key=(self.source, self.line_number, line))
+        elif self.shedder.admit(result, parsed):
+            await self.shedder.track(
+                self.indexer.index(result, key=(self.source, self.line_number, line)))
 
 
-    @gen.coroutine
     def on_close(self):
-        #Close es connection?
         logger.info("Connection to %s closed", self.address)
-        yield []
+
+    def teardown(self):
+        """Release everything this handler holds on to, so that nothing
+        outlives the connection until the next garbage collection"""
+        if self._idle_handle is not None:
+            self.stream.io_loop.remove_timeout(self._idle_handle)
+            self._idle_handle = None
+        if self._flush_handle is not None:
+            self.stream.io_loop.remove_timeout(self._flush_handle)
+            self._flush_handle = None
+        logger.debug("Peak buffer use for connection to %s was %d bytes",
+                     self.address, self.framer.peak_buffered)
+        self.framer.release()
+        #the stream is still open if reading from it failed
+        if not self.stream.closed():
+            self.stream.close()
+        self.stream = None
+        self.indexer = None
+        self.line_processor = None
+        self.framer = None
+        self.quota = None
+        self.multiline = None
 
 class MockIndexer:
-    def index(self, doc):
+    async def index(self, doc, key=None):
         pass
 
 DEFAULT_HEARTBEAT_COUNT = 200
+DEFAULT_IDLE_TIMEOUT = None
+DEFAULT_MEMORY_REPORT_INTERVAL = 60
+#the number of connections with the most buffered bytes that are logged
+MEMORY_REPORT_CONNECTIONS = 10
 
 class MainHandler(tornado.tcpserver.TCPServer):
 
@@ -97,27 +288,153 @@ class MainHandler(tornado.tcpserver.TCPServer):
         self.processor_spec = config.get('processor_spec')
         self.processor_class = config.get('processor_class')
         assert self.processor_spec is not None or self.processor_class is not None
-        super().__init__()
+        self.max_line_bytes = config.get('max_line_bytes', DEFAULT_MAX_LINE_BYTES)
+        self.budget = BufferBudget(config.get('max_total_buffer_bytes',
+                                              DEFAULT_MAX_TOTAL_BUFFER_BYTES))
+        self.idle_timeout = config.get('idle_timeout', DEFAULT_IDLE_TIMEOUT)
+        self.framing = config.get('framing', NEWLINE_FRAMING)
+        self.syslog_header = config.get('syslog_header', False)
+        self.multiline = (MultilineSpec(config['multiline'])
+                          if config.get('multiline') is not None else None)
+        self.stages = load_stages(config)
+        self.scheduler = Scheduler(config.get('scheduling'))
+        self.shedder = (LoadShedder(config['load_shedding'])
+                        if config.get('load_shedding') is not None else None)
+        self.memory_report_interval = config.get('memory_report_interval',
+                                                 DEFAULT_MEMORY_REPORT_INTERVAL)
+        self.memory_reporter = None
+        self.connections = set()
+        self.line_processor = self.load_processor()
+        self.indexer = self.load_indexer()
+        if self.shedder is not None:
+            for output in self.outputs():
+                if hasattr(output, 'queue'):
+                    self.shedder.watch(output.queue)
+        super().__init__(max_buffer_size=config.get('max_buffer_bytes',
+                                                    DEFAULT_MAX_BUFFER_BYTES))
 
     def load_processor(self):
-        if self.processor_spec:
-            line_processor = LineProcessor(self.processor_spec)
-        else:
-            module_name,class_name = self.processor_class.rsplit('.', 1)
-            module = importlib.import_module(module_name)
-            _class = getattr(module, class_name)
-            line_processor = _class()
-        return line_processor
-
-    @gen.coroutine
-    def handle_stream(self, stream, address):
+        return load_processor(self.processor_spec, self.processor_class)
+
+    def swap_processor(self, line_processor, processor_spec=None, processor_class=None):
+        """Use line_processor for all lines from now on, including those of
+        the connections that are already open. The index template is
+        updated if it was generated from the old processor."""
+        self.processor_spec = processor_spec
+        self.processor_class = processor_class
+        self.line_processor = line_processor
+        for cn in self.connections:
+            cn.line_processor = line_processor
+        for output in self.outputs():
+            sink = getattr(output, 'sink', output)
+            if isinstance(sink, ESIndexer) and sink.template is not None:
+                template = self.index_template({'index_pattern': sink.index_pattern})
+                sink.template = template
+                tornado.ioloop.IOLoop.current().add_future(
+                    gen.convert_yielded(sink._put_template(template_name(template),
+                                                           template)),
+                    self._template_done)
+
+    def outputs(self):
+        """Return the indexer, or each of its outputs if it fans out"""
+        return getattr(self.indexer, 'outputs', [self.indexer])
+
+    def _template_done(self, future):
+        if future.exception() is not None:
+            logger.error("Error installing index template: %s", future.exception())
+
+    def load_indexer(self):
+        if self.config.get('outputs') is not None:
+            return load_outputs(self.config['outputs'], self.load_es_sink)
         if self.es_config is None:
-            indexer = MockIndexer()
-        else:
-            indexer = ESIndexer(**self.es_config)
+            return MockIndexer()
+        return ESIndexer(template=self.index_template(), **self.es_config)
+
+    def load_es_sink(self, es_config):
+        """Create the sink of an elasticsearch output, which uses
+        indexer_config unless it has options of its own"""
+        es_config = es_config or self.es_config
+        if not es_config:
+            raise ValueError("An elasticsearch output needs host and port, either as "
+                             "options of its own or in indexer_config")
+        return ESIndexer(template=self.index_template(es_config), **es_config)
+
+    async def close(self):
+        """Stop accepting connections, close the open ones, and write out
+        whatever the indexer still has queued"""
+        self.stop()
+        self.stop_memory_reports()
+        for cn in list(self.connections):
+            if cn.stream is not None:
+                cn.stream.close()
+        close = getattr(self.indexer, 'close', None)
+        #ESIndexer.close returns nothing, outputs are coroutines
+        closed = close() if close is not None else None
+        if closed is not None:
+            await closed
+
+    def index_template(self, es_config=None):
+        """Generate the index template from the types of the fields the
+        processor produces, or return None to use the catch-all template
+        if the mapping is disabled"""
+        es_config = es_config or self.es_config
+        mapping = self.config.get('mapping') or {}
+        if not mapping.get('enabled', True):
+            return None
+        field_types = {}
+        if self.syslog_header:
+            field_types.update(SYSLOG_FIELD_TYPES)
+        if hasattr(self.line_processor, 'field_types'):
+            field_types.update(self.line_processor.field_types())
+        return build_template(es_config.get('index_pattern', DEFAULT_INDEX_PATTERN),
+                              field_types,
+                              keyword=mapping.get('keyword', ()),
+                              not_indexed=mapping.get('not_indexed', ()))
+
+    async def handle_stream(self, stream, address):
         cn = ConnectionHandler(stream, address,
-                               indexer,
-                               self.load_processor(),
+                               self.indexer,
+                               self.line_processor,
                                heartbeat_count=self.config.get('heartbeat_count',
-                                                               DEFAULT_HEARTBEAT_COUNT))
-        yield cn.on_connect()
+                                                               DEFAULT_HEARTBEAT_COUNT),
+                               max_line_bytes=self.max_line_bytes,
+                               budget=self.budget,
+                               idle_timeout=self.idle_timeout,
+                               quota=self.scheduler.quota_for(address),
+                               framing=self.framing,
+                               syslog_header=self.syslog_header,
+                               multiline=self.multiline,
+                               stages=self.stages,
+                               shedder=self.shedder)
+        self.connections.add(cn)
+        try:
+            await cn.on_connect()
+        finally:
+            self.connections.discard(cn)
+
+    def memory_report(self):
+        """Return the buffered bytes per connection source, and the total
+        of partial lines for all connections"""
+        per_connection = {cn.source: cn.buffered_bytes() for cn in self.connections}
+        return per_connection, self.budget.total
+
+    def log_memory_report(self):
+        per_connection, total = self.memory_report()
+        logger.info("%d connections, %d bytes of partial lines buffered in total",
+                    len(per_connection), total)
+        largest = sorted(per_connection.items(), key=lambda item: item[1], reverse=True)
+        for source, buffered in largest[:MEMORY_REPORT_CONNECTIONS]:
+            if buffered:
+                logger.info("Connection %s buffers %d bytes", source, buffered)
+
+    def start_memory_reports(self):
+        if not self.memory_report_interval:
+            return
+        self.memory_reporter = tornado.ioloop.PeriodicCallback(
+            self.log_memory_report, self.memory_report_interval * 1000)
+        self.memory_reporter.start()
+
+    def stop_memory_reports(self):
+        if self.memory_reporter is not None:
+            self.memory_reporter.stop()
+            self.memory_reporter = None
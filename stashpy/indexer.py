@@ -1,11 +1,18 @@
 from uuid import uuid4
 from datetime import datetime
+import re
+import copy
 import json
+import hashlib
 import logging
+import itertools
 
 import tornado.httpclient
+import tornado.ioloop
 from tornado import gen
 
+from .compression import Compressor
+
 logger = logging.getLogger(__name__)
 
 DEFAULT_INDEX_PATTERN = "stashpy-%Y-%m-%d"
@@ -57,45 +64,277 @@ INDEX_TEMPLATE = {
   }
 }
 
+#mappings for the type names returned by LineProcessor.field_types
+FIELD_MAPPINGS = {
+    'int': {"type": "long"},
+    'float': {"type": "double"},
+    'bool': {"type": "boolean"},
+    'datetime': {"type": "date"},
+    'keyword': {"type": "string", "index": "not_analyzed", "ignore_above": 256},
+    'str': INDEX_TEMPLATE["mappings"]["_default_"]["dynamic_templates"][1]
+                         ["string_fields"]["mapping"],
+}
+NOT_INDEXED_MAPPINGS = {
+    'int': {"type": "long", "index": "no"},
+    'float': {"type": "double", "index": "no"},
+    'bool': {"type": "boolean", "index": "no"},
+    'datetime': {"type": "date", "index": "no"},
+}
+NOT_INDEXED_STRING = {"type": "string", "index": "no"}
+_INDEX_PATTERN_FIELD_RE = re.compile(r'%.|\{[^}]*\}')
+
+
+def index_glob(index_pattern):
+    """Return the wildcard pattern matching the names of the indices
+    created with index_pattern"""
+    return re.sub(r'\*(?:[-_.]*\*)+', '*', _INDEX_PATTERN_FIELD_RE.sub('*', index_pattern))
+
+
+def build_template(index_pattern, field_types, keyword=(), not_indexed=()):
+    """Build an index template for the indices created with index_pattern,
+    with explicit mappings for the fields in field_types, a dictionary of
+    field names to type names. String fields in keyword are not analyzed,
+    and fields in not_indexed are stored but cannot be searched. Other
+    fields are mapped dynamically as with the catch-all template."""
+    template = copy.deepcopy(INDEX_TEMPLATE)
+    template["template"] = index_glob(index_pattern)
+    #take precedence over the catch-all template if it is installed
+    template["order"] = 1
+    properties = template["mappings"]["_default_"]["properties"]
+    keyword, not_indexed = set(keyword), set(not_indexed)
+    for name, type_name in sorted(field_types.items()):
+        if name in properties or name.startswith('_'):
+            continue
+        if name in not_indexed:
+            mapping = NOT_INDEXED_MAPPINGS.get(type_name, NOT_INDEXED_STRING)
+        elif name in keyword and type_name in ('str', 'keyword'):
+            mapping = FIELD_MAPPINGS['keyword']
+        else:
+            mapping = FIELD_MAPPINGS.get(type_name, FIELD_MAPPINGS['str'])
+        properties[name] = copy.deepcopy(mapping)
+    properties["truncated"] = copy.deepcopy(FIELD_MAPPINGS['bool'])
+    return template
+
+
+def template_name(template):
+    """Name for a generated template, derived from the indices it is for"""
+    return 'stashpy_' + re.sub(r'[^\w-]+', '_', template["template"]).strip('_-')
+
+ID_AUTO = 'auto'
+ID_SEQUENCE = 'sequence'
+ID_UUID = 'uuid'
+ID_HASH = 'hash'
+DEFAULT_ID_STRATEGY = ID_SEQUENCE
+#request errors after which a document with an ID is sent again
+RETRY_CODES = (429, 502, 503, 504, 599)
+DEFAULT_RETRY_DELAY = 1
+
+
+class SequenceIDs:
+    """Unique document IDs made of a random prefix, chosen once per
+    process, and a counter. Much cheaper than a uuid4 per document."""
+
+    def __init__(self):
+        self.prefix = uuid4().hex[:16]
+        self.counter = itertools.count()
+
+    def __call__(self):
+        return '{}{:x}'.format(self.prefix, next(self.counter))
+
+
+def content_id(source, offset, line):
+    """Document ID derived from where a line was read and the line itself,
+    so that a line that is read again gets the same ID"""
+    key = '{}\n{}\n{}'.format(source, offset, line)
+    return hashlib.sha1(key.encode('utf-8', errors='surrogateescape')).hexdigest()
+
+
+def document_ids(strategy=DEFAULT_ID_STRATEGY):
+    """Return a function that returns the ID of a document given its key,
+    a (source, offset, line) tuple or None, according to strategy:
+
+    - auto: No ID; ElasticSearch generates one.
+    - sequence: A SequenceIDs ID.
+    - uuid: A random uuid4.
+    - hash: The content_id of the key, or a sequence ID if the document
+      has no key."""
+    if strategy == ID_AUTO:
+        return lambda key: None
+    if strategy == ID_UUID:
+        return lambda key: str(uuid4())
+    sequence = SequenceIDs()
+    if strategy == ID_SEQUENCE:
+        return lambda key: sequence()
+    if strategy == ID_HASH:
+        return lambda key: sequence() if key is None else content_id(*key)
+    raise ValueError("Unknown document ID strategy {}".format(strategy))
+
+
+def index_name(doc, index_pattern):
+    """Determine the index for doc from the _index_ key of doc if it has
+    one, or from index_pattern. The pattern is passed through strftime,
+    and then formatted with doc if it has any replacement fields."""
+    index = datetime.strftime(datetime.now(),
+                              doc.pop('_index_', index_pattern))
+    if '{' in index and '}' in index:
+        index = index.format(**doc)
+    return index
+
 
 class ESIndexer:
 
-    def __init__(self, host, port, index_pattern=DEFAULT_INDEX_PATTERN, doc_type='doc'):
+    def __init__(self, host, port, index_pattern=DEFAULT_INDEX_PATTERN, doc_type='doc',
+                 template=None, id_strategy=DEFAULT_ID_STRATEGY, retries=0,
+                 retry_delay=DEFAULT_RETRY_DELAY, compression=None):
         self.base_url = 'http://{}:{}'.format(host.rstrip('/'), port)
         self.client = tornado.httpclient.AsyncHTTPClient()
         self.index_pattern = index_pattern
         self.doc_type = doc_type
-        self._check_template()
+        self.id_strategy = id_strategy
+        self.document_id = document_ids(id_strategy)
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.compressor = Compressor(compression) if compression else None
+        self.template = template
+        io_loop = tornado.ioloop.IOLoop.current()
+        if template is None:
+            io_loop.spawn_callback(self._check_template)
+        else:
+            io_loop.spawn_callback(self._put_template, template_name(template), template)
+
+    async def _put_template(self, name, template):
+        #generated templates are always replaced, as the specs may have changed
+        url = self.base_url + "/_template/{}/".format(name)
+        request = tornado.httpclient.HTTPRequest(url, method='PUT', headers=None,
+                                                 body=json.dumps(template))
+        response = await self.client.fetch(request)
+        logger.info("Installed index template %s for %s", name, template["template"])
 
-    @gen.coroutine
-    def _check_template(self):
+    async def _check_template(self):
         #see whether there is a template
         url = self.base_url + "/_template/"
         request = tornado.httpclient.HTTPRequest(url, method='GET', headers=None)
-        response = yield self.client.fetch(request)
+        response = await self.client.fetch(request)
         templates = json.loads(response.body.decode('utf-8'))
         if 'stashpy_template' in templates:
             return
         url = self.base_url + "/_template/{}/".format(TEMPLATE_NAME)
         request = tornado.httpclient.HTTPRequest(url, method='PUT', headers=None, body=json.dumps(INDEX_TEMPLATE))
-        response = yield self.client.fetch(request)
+        response = await self.client.fetch(request)
         ack = json.loads(response.body.decode('utf-8'))
         #TODO check ack
 
 
-    def _create_request(self, doc):
-        doc_id = str(uuid4())
-        index = datetime.strftime(datetime.now(),
-                                  doc.pop('_index_', self.index_pattern))
-        if '{' in index and '}' in index:
-            index = index.format(**doc)
-        url = self.base_url + "/{}/{}/{}".format(index, self.doc_type, doc_id)
-        return tornado.httpclient.HTTPRequest(url, method='POST', headers=None, body=json.dumps(doc))
+    def _create_request(self, doc, key=None):
+        doc_id = self.document_id(key)
+        index = index_name(doc, self.index_pattern)
+        if doc_id is None:
+            url = self.base_url + "/{}/{}/".format(index, self.doc_type)
+            method = 'POST'
+        else:
+            url = self.base_url + "/{}/{}/{}".format(index, self.doc_type, doc_id)
+            method = 'PUT'
+        return tornado.httpclient.HTTPRequest(url, method=method, headers=None, body=json.dumps(doc))
+
+    async def _fetch(self, request, retry=None):
+        """Send request, retrying it on errors that are likely to be
+        temporary if it has a document ID, so that it cannot create a
+        duplicate. retry overrides whether the request can be retried."""
+        if retry is None:
+            retry = request.method == 'PUT'
+        attempt = 0
+        while True:
+            try:
+                response = await self.client.fetch(request)
+            except tornado.httpclient.HTTPError as exc:
+                if not retry or attempt >= self.retries or exc.code not in RETRY_CODES:
+                    raise
+                attempt += 1
+                logger.info("Index request failed with %s, retrying (%d/%d)",
+                            exc, attempt, self.retries)
+                await gen.sleep(self.retry_delay * attempt)
+            else:
+                return response
+
+    async def _compress(self, request):
+        if self.compressor is not None:
+            request.body, headers = await self.compressor.compress_async(request.body)
+            request.headers.update(headers)
+
+    def _bulk_actions(self, items):
+        """Return the (action, has_id) tuples of a bulk request indexing
+        the (doc, key) tuples in items, where action is the two lines of
+        the action and the document"""
+        actions = []
+        for doc, key in items:
+            if '_index_' in doc:
+                #the same document can be written to other outputs
+                doc = dict(doc)
+            action = {'_index': index_name(doc, self.index_pattern), '_type': self.doc_type}
+            doc_id = self.document_id(key)
+            if doc_id is not None:
+                action['_id'] = doc_id
+            actions.append((json.dumps({'index': action}) + '\n' + json.dumps(doc),
+                            doc_id is not None))
+        return actions
+
+    async def write(self, items):
+        """Index the (doc, key) tuples in items with a single bulk
+        request. Documents that fail individually because the cluster is
+        overloaded, e.g. as the bulk queue is full, are sent again in
+        another bulk request if they have IDs, as often as whole
+        requests are retried."""
+        actions = self._bulk_actions(items)
+        attempt = 0
+        while True:
+            request = tornado.httpclient.HTTPRequest(
+                self.base_url + '/_bulk', method='POST',
+                body='\n'.join(action for action, _has_id in actions) + '\n',
+                headers={'Content-Type': 'application/x-ndjson'})
+            await self._compress(request)
+            response = await self._fetch(request,
+                                         retry=all(has_id for _action, has_id in actions))
+            result = json.loads(response.body.decode('utf-8'))
+            if not result.get('errors'):
+                return
+            failed, retry = 0, []
+            for (action, has_id), item in zip(actions, result['items']):
+                status = list(item.values())[0].get('status', 500)
+                if 200 <= status < 300:
+                    continue
+                if has_id and status in RETRY_CODES:
+                    retry.append((action, has_id))
+                else:
+                    failed += 1
+            if retry and attempt < self.retries:
+                attempt += 1
+                logger.info("%d documents in bulk request failed, retrying (%d/%d)",
+                            len(retry), attempt, self.retries)
+                await gen.sleep(self.retry_delay * attempt)
+                if failed:
+                    logger.warning("%d documents in bulk request could not be indexed",
+                                   failed)
+                actions = retry
+                continue
+            failed += len(retry)
+            if failed:
+                logger.warning("%d of %d documents in bulk request could not be indexed",
+                               failed, len(actions))
+            return
+
+    async def flush(self):
+        pass
+
+    def close(self):
+        if self.compressor is not None:
+            self.compressor.close()
 
-    @gen.coroutine
-    def index(self, doc):
-        request = self._create_request(doc)
-        response = yield self.client.fetch(request)
+    async def index(self, doc, key=None):
+        """Index doc. key is the (source, offset, line) tuple identifying the
+        line doc was created from, if known, for the hash ID strategy."""
+        request = self._create_request(doc, key)
+        await self._compress(request)
+        response = await self._fetch(request)
         if 200 <= response.code < 300:
             logger.debug("Successfully indexed doc, url: {}".format(
                 response.effective_url))
@@ -1,40 +1,168 @@
 import sys
 import os
+import signal
 import logging
 import logging.config
+from concurrent.futures import ThreadPoolExecutor
 
 import tornado.ioloop
+from tornado import gen
 import yaml
 
 from .handler import MainHandler
+from .eventloop import install_event_loop
+from .processor import load_processor, validate_processor
+from .udp import UDPListener
+from .filetail import FileTailer
 from stashpy import constants
 
 logger = logging.getLogger(__name__)
 
+def read_config(config_path):
+    with open(config_path, 'r') as config_file:
+        return yaml.safe_load(config_file)
+
+
+def compile_processor(config_path):
+    """Read the configuration at config_path, and create the line processor
+    it specifies. The processor has to parse the lines in the
+    validation_lines of the configuration. Returns the processor, its
+    spec, and its class."""
+    config = read_config(config_path)
+    processor_spec = config.get('processor_spec')
+    processor_class = config.get('processor_class')
+    if processor_spec is None and processor_class is None:
+        raise ValueError("Neither processor_spec nor processor_class is configured")
+    line_processor = load_processor(processor_spec, processor_class)
+    validate_processor(line_processor, config.get('validation_lines', ()))
+    return line_processor, processor_spec, processor_class
+
+
 class App:
-    def __init__(self, config):
+    def __init__(self, config, config_path=None):
         assert 'processor_spec' in config or 'processor_class' in config
         self.config = config
+        self.config_path = config_path
+        self.reloading = False
+        self.stopping = False
         self.main = MainHandler(config)
+        validate_processor(self.main.line_processor, config.get('validation_lines', ()))
+        self.udp = None
+        if config.get('udp') is not None:
+            self.udp = UDPListener(config['udp'],
+                                   self.main.indexer,
+                                   self.main.line_processor,
+                                   syslog_header=self.main.syslog_header,
+                                   stages=self.main.stages,
+                                   shedder=self.main.shedder)
+        self.files = None
+        if config.get('files') is not None:
+            self.files = FileTailer(config['files'],
+                                    self.main.indexer,
+                                    self.main.line_processor,
+                                    syslog_header=self.main.syslog_header,
+                                    stages=self.main.stages)
 
-    def run(self):
+    def start(self):
+        """Start accepting lines on all inputs. This can be done on an
+        event loop that is already running, e.g. in tests."""
         port = self.config.get('port', constants.DEFAULT_PORT)
         address = self.config.get('address', constants.DEFAULT_ADDRESS)
         self.main.listen(port, address=address)
         logger.info("Stashpy started, accepting connections on {}:{}".format(
             'localhost',
             port))
+        if self.udp is not None:
+            self.udp.listen()
+        if self.files is not None:
+            self.files.start()
+        if self.main.shedder is not None:
+            self.main.shedder.start()
+        self.main.start_memory_reports()
+
+    def run(self):
+        """Start, and run the event loop until Stashpy is stopped with
+        SIGTERM or SIGINT; SIGHUP reloads the processor"""
+        self.start()
         io_loop = tornado.ioloop.IOLoop.current()
-        if not io_loop._running:
-            io_loop.start()
+        if self.config_path is not None:
+            io_loop.asyncio_loop.add_signal_handler(signal.SIGHUP, self._reload_callback)
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            io_loop.asyncio_loop.add_signal_handler(signum, self._stop_callback)
+        io_loop.start()
+
+    def _stop_callback(self):
+        if self.stopping:
+            return
+        tornado.ioloop.IOLoop.current().add_future(gen.convert_yielded(self.shutdown()),
+                                                   self._shutdown_done)
+
+    def _shutdown_done(self, future):
+        if future.exception() is not None:
+            logger.error("Error shutting down: %s", future.exception())
+        logger.info("Stashpy stopped")
+        tornado.ioloop.IOLoop.current().stop()
+
+    async def shutdown(self):
+        """Stop all inputs, and wait until the documents they produced are
+        written out and the outputs are closed, so that no queued
+        documents are lost and compressed files are complete"""
+        self.stopping = True
+        logger.info("Stopping Stashpy")
+        for source in (self.udp, self.files):
+            if source is not None:
+                source.stop()
+        if self.main.shedder is not None:
+            self.main.shedder.stop()
+        await self.main.close()
+
+    def _reload_callback(self):
+        tornado.ioloop.IOLoop.current().add_future(gen.convert_yielded(self.reload()),
+                                                   self._reload_done)
+
+    def _reload_done(self, future):
+        if future.exception() is not None:
+            logger.error("Error reloading processor: %s", future.exception())
+
+    async def reload(self):
+        """Compile the processor of the configuration file in a separate
+        thread, so that lines keep being processed with the current one
+        meanwhile, and then switch all inputs over to it at once. Returns
+        whether the processor was replaced."""
+        if self.reloading:
+            logger.info("Already reloading the processor")
+            return False
+        self.reloading = True
+        logger.info("Reloading the processor from %s", self.config_path)
+        try:
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                line_processor, processor_spec, processor_class = (
+                    await tornado.ioloop.IOLoop.current().run_in_executor(
+                        executor, compile_processor, self.config_path))
+        except Exception as exc:
+            logger.error("Keeping the current processor, new one is not valid: %s", exc)
+            return False
+        finally:
+            self.reloading = False
+        self.swap_processor(line_processor, processor_spec, processor_class)
+        logger.info("Processor reloaded")
+        return True
+
+    def swap_processor(self, line_processor, processor_spec=None, processor_class=None):
+        #this runs on the IOLoop, so no lines are processed during the swap
+        self.main.swap_processor(line_processor, processor_spec, processor_class)
+        for source in (self.udp, self.files):
+            if source is not None:
+                source.line_processor = line_processor
+
 
 def run():
     config_path = os.path.abspath(sys.argv[1])
-    with open(config_path, 'r') as config_file:
-        config = yaml.load(config_file)
+    config = read_config(config_path)
     logging.config.dictConfig(config.pop('logging', constants.DEFAULT_LOGGING))
     try:
-        app = App(config)
+        install_event_loop(config.get('event_loop'))
+        app = App(config, config_path=config_path)
         app.run()
     except:
         logging.exception('Exception: ')
@@ -0,0 +1,88 @@
+"""Merging of multi-line events such as stack traces into a single line
+before they are processed."""
+import regex
+
+DEFAULT_CONTINUATION = (r"^(\s|Traceback \(most recent call last\):|Caused by: |"
+                        r"During handling of the above exception|"
+                        r"The above exception was the direct cause|"
+                        r"[\w.$]+(Error|Exception|Throwable)(: |$))")
+DEFAULT_MAX_LINES = 500
+DEFAULT_MAX_BYTES = 64 * 1024
+DEFAULT_FLUSH_TIMEOUT = 1
+
+
+def _byte_length(line):
+    return len(line.encode('utf-8', errors='surrogateescape'))
+
+
+class MultilineSpec:
+    """Which lines belong together. If start is given, every line that
+    matches it starts a new event, and all other lines are appended to the
+    current one. Otherwise, lines matching continuation are appended to
+    the current event, and all other lines start a new one."""
+
+    def __init__(self, config=None):
+        config = config or {}
+        start = config.get('start')
+        self.start = regex.compile(start) if start else None
+        self.continuation = regex.compile(config.get('continuation', DEFAULT_CONTINUATION))
+        self.max_lines = config.get('max_lines', DEFAULT_MAX_LINES)
+        self.max_bytes = config.get('max_bytes', DEFAULT_MAX_BYTES)
+        self.flush_timeout = config.get('flush_timeout', DEFAULT_FLUSH_TIMEOUT)
+
+    def continues(self, line):
+        if self.start is not None:
+            return self.start.match(line) is None
+        return self.continuation.match(line) is not None
+
+    def aggregator(self):
+        return MultilineAggregator(self)
+
+
+class MultilineAggregator:
+    """Collects the lines of the current event for a single source"""
+
+    #size is the length of the event in UTF-8 encoded bytes
+    __slots__ = ('spec', 'lines', 'size', 'truncated', 'last_update')
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.lines = []
+        self.size = 0
+        self.truncated = False
+        self.last_update = None
+
+    @property
+    def pending(self):
+        return bool(self.lines)
+
+    def feed(self, line, truncated=False, now=None):
+        """Add a line, and return a list of the (event, truncated) tuples
+        that are complete as a result"""
+        self.last_update = now
+        if self.lines and self.spec.continues(line):
+            size = _byte_length(line) + 1
+            if (len(self.lines) >= self.spec.max_lines or
+                self.size + size > self.spec.max_bytes):
+                self.truncated = True
+            else:
+                self.lines.append(line)
+                self.size += size
+                self.truncated |= truncated
+            return []
+        completed = self.flush()
+        self.lines = [line]
+        self.size = _byte_length(line)
+        self.truncated = truncated
+        return [completed] if completed is not None else []
+
+    def flush(self):
+        """Return the current event and start over, or return None if there
+        is no current event"""
+        if not self.lines:
+            return None
+        event = ('\n'.join(self.lines), self.truncated)
+        self.lines = []
+        self.size = 0
+        self.truncated = False
+        return event
@@ -1,3 +1,4 @@
+import string
 import regex
 import parse
 import pkgutil
@@ -40,6 +41,19 @@ class LineParser:
             return None
         return self.type_collection.convert_fields(match.groupdict())
 
+    def field_types(self):
+        """Return a dictionary of the names of the fields this parser
+        produces to the names of their types: one of str, int, float, bool
+        and datetime"""
+        if self.re:
+            types = {name: 'str' for name in self.re.groupindex}
+            for name, _type in self.type_collection.types.items():
+                types[name] = getattr(_type, '__name__', 'str')
+            return types
+        return {name: parse_format_type(format_spec)
+                for _, name, format_spec, _ in string.Formatter().parse(self.parse._format)
+                if name}
+
     def __call__(self, line):
         if self.re:
             return self._re_match(line)
@@ -48,6 +62,25 @@ class LineParser:
             return None
         return match.named
 
+PARSE_INT_TYPES = set('dnboxX')
+PARSE_FLOAT_TYPES = set('fFeEg%')
+
+def parse_format_type(format_spec):
+    """Return the name of the type a parse format spec such as 'd', '.2f'
+    or 'ti' converts to"""
+    type_code = format_spec or ''
+    start = len(type_code)
+    while start > 0 and (type_code[start - 1].isalpha() or type_code[start - 1] == '%'):
+        start -= 1
+    type_code = type_code[start:]
+    if type_code in PARSE_INT_TYPES:
+        return 'int'
+    if type_code in PARSE_FLOAT_TYPES:
+        return 'float'
+    if type_code.startswith('t') and len(type_code) == 2:
+        return 'datetime'
+    return 'str'
+
 def read_patterns():
     data = pkgutil.get_data('stashpy', 'patterns/grok_patterns.txt').decode('utf-8')
     patterns = {}
@@ -2,8 +2,16 @@ import sys
 import json
 import logging
 import copy
+import importlib
+from datetime import datetime
+
+import pytz
 
 from .pattern_matching import LineParser
+from .syslog import parse_syslog_header
+from .structured import DECODERS
+from .timestamps import TimestampStage
+from .geoip import GeoIPStage
 
 logger = logging.getLogger(__name__)
 
@@ -22,6 +30,9 @@ class FormatSpec:
         self._format_dict(output, result)
         return output
 
+    def field_types(self):
+        return {key: 'str' for key in self.out_format}
+
     def _format_dict(self, out_dict, value_dict):
         for key,val in out_dict.items():
             if isinstance(key, dict):
@@ -30,27 +41,66 @@ class FormatSpec:
                 out_dict[key] = val.format(**value_dict)
 
 
+class LowPriority(dict):
+    """The result of a spec marked as low priority; such lines are shed
+    before others when indexing cannot keep up"""
+
+
 class LineProcessor:
 
     def __init__(self, specs=None):
-        to_dict_specs, to_format_specs = [], {}
+        to_dict_specs, to_format_specs, structured, low_priority = [], {}, [], []
         if specs:
             to_dict_specs = specs.get('to_dict', [])
             to_format_specs = specs.get('to_format', {})
+            structured = specs.get('structured', [])
+            low_priority = specs.get('low_priority', [])
         else:
             if hasattr(self, 'TO_DICT'):
                 to_dict_specs = self.TO_DICT
             if hasattr(self, 'TO_FORMAT'):
                 to_format_specs = self.TO_FORMAT
+            if hasattr(self, 'STRUCTURED'):
+                structured = self.STRUCTURED
+            if hasattr(self, 'LOW_PRIORITY'):
+                low_priority = self.LOW_PRIORITY
+        self.decoders = [DECODERS[name] for name in structured]
         self.dict_specs = [LineParser(spec) for spec in to_dict_specs]
         self.format_specs = [FormatSpec(LineParser(format_spec), output_spec)
                              for format_spec, output_spec in to_format_specs.items()]
+        low_priority = set(low_priority)
+        self.low_priority = set(
+            [parser for spec, parser in zip(to_dict_specs, self.dict_specs)
+             if spec in low_priority] +
+            [format_spec for spec, format_spec in zip(to_format_specs, self.format_specs)
+             if spec in low_priority])
 
 
+    def field_types(self):
+        """Return the types of the fields the specs of this processor
+        produce, as a dictionary of field name to type name. Fields that
+        have different types in different specs are strings."""
+        types = {}
+        for spec in self.dict_specs + self.format_specs:
+            for name, type_name in spec.field_types().items():
+                if types.get(name, type_name) != type_name:
+                    type_name = 'str'
+                types[name] = type_name
+        return types
+
+    def do_structured(self, line):
+        for decoder in self.decoders:
+            decoded = decoder(line)
+            if decoded is not None:
+                return decoded
+        return None
+
     def do_dict_specs(self, line):
         for dict_spec in self.dict_specs:
             dicted = dict_spec(line)
             if dicted:
+                if dict_spec in self.low_priority:
+                    return LowPriority(dicted)
                 return dicted
         return None
 
@@ -58,10 +108,16 @@ class LineProcessor:
         for format_spec in self.format_specs:
             formatted = format_spec(line)
             if formatted:
+                if format_spec in self.low_priority:
+                    return LowPriority(formatted)
                 return formatted
         return None
 
     def for_line(self, line):
+        if self.decoders:
+            structured_result = self.do_structured(line)
+            if structured_result is not None:
+                return structured_result
         dict_result = self.do_dict_specs(line)
         if dict_result:
             return dict_result
@@ -69,3 +125,66 @@ class LineProcessor:
         if format_result:
             return format_result
         return None
+
+
+def make_document(line_processor, line, syslog_header=False, stages=()):
+    """Process a line with line_processor and turn the result into a
+    document ready for indexing. Returns the document, and whether the
+    line could be parsed. If syslog_header is true, the syslog header is
+    parsed into fields first, and only the message body is passed on to
+    line_processor. A line of several lines, such as a merged multi-line
+    event, that cannot be parsed as a whole is parsed by its first line,
+    while the message is still all of it. Each of stages is then called
+    with the document to enrich it further."""
+    header = parse_syslog_header(line) if syslog_header else None
+    if header is not None:
+        header_fields, line = header
+    result = line_processor.for_line(line)
+    if result is None and '\n' in line:
+        result = line_processor.for_line(line[:line.index('\n')])
+    if result is None:
+        logger.debug("Line not parsed, storing whole message")
+        result = {'message': line, '@version': 1}
+        parsed = False
+    else:
+        logger.debug("Match: %s", str(result))
+        result['message'] = line
+        result['@version'] = 1
+        parsed = True
+    if header is not None:
+        for key, value in header_fields.items():
+            result.setdefault(key, value)
+    for stage in stages:
+        stage(result)
+    if '@timestamp' not in result:
+        result['@timestamp'] = datetime.utcnow().replace(tzinfo=pytz.utc).isoformat()
+    return result, parsed
+
+
+def load_processor(processor_spec=None, processor_class=None):
+    """Create a line processor either from a spec, or by instantiating the
+    class at the dotted path processor_class"""
+    if processor_spec:
+        return LineProcessor(processor_spec)
+    module_name,class_name = processor_class.rsplit('.', 1)
+    module = importlib.import_module(module_name)
+    _class = getattr(module, class_name)
+    return _class()
+
+
+def validate_processor(line_processor, lines=()):
+    """Raise a ValueError unless line_processor can parse each of lines"""
+    for line in lines:
+        if line_processor.for_line(line) is None:
+            raise ValueError("Processor cannot parse {!r}".format(line))
+
+
+def load_stages(config):
+    """Create the stages that are run on every document, in the order in
+    which they are run"""
+    stages = []
+    if config.get('timestamp') is not None:
+        stages.append(TimestampStage(config['timestamp']))
+    if config.get('geoip') is not None:
+        stages.append(GeoIPStage(config['geoip']))
+    return stages
@@ -0,0 +1,113 @@
+"""Fair sharing of the IOLoop between connections. Every connection
+gets a quantum of lines it may process before it has to give the other
+connections a turn, and can optionally be rate limited with a token
+bucket. Both can be configured per client class, selected by the
+source address of the connection."""
+import ipaddress
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUANTUM = 100
+
+
+class TokenBucket:
+
+    __slots__ = ('rate', 'burst', 'tokens', 'last')
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst or rate)
+        self.tokens = self.burst
+        self.last = None
+
+    def consume(self, now, amount=1):
+        """Take amount tokens from the bucket, and return the number of
+        seconds the caller has to wait before the bucket is no longer in
+        debt."""
+        if self.last is not None:
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        self.tokens -= amount
+        if self.tokens >= 0:
+            return 0
+        return -self.tokens / self.rate
+
+
+class ClientQuota:
+    """The share of a single connection"""
+
+    __slots__ = ('quantum', 'bucket', 'used')
+
+    def __init__(self, quantum, bucket=None):
+        self.quantum = quantum
+        self.bucket = bucket
+        self.used = 0
+
+    def charge(self, now):
+        """Account for a processed line. Returns None if the connection can
+        go on, or the number of seconds it should sleep otherwise; 0 means
+        only yielding to the other connections."""
+        self.used += 1
+        if self.bucket is not None:
+            delay = self.bucket.consume(now)
+            if delay:
+                self.used = 0
+                return delay
+        if self.used >= self.quantum:
+            self.used = 0
+            return 0
+        return None
+
+
+class ClientClass:
+
+    def __init__(self, name, networks=(), weight=1, rate=None, burst=None,
+                 quantum=DEFAULT_QUANTUM):
+        self.name = name
+        self.networks = [ipaddress.ip_network(network, strict=False)
+                         for network in networks]
+        self.quantum = max(1, int(quantum * weight))
+        self.rate = rate
+        self.burst = burst
+
+    def matches(self, ip):
+        return any(ip in network for network in self.networks)
+
+    def quota(self):
+        bucket = TokenBucket(self.rate, self.burst) if self.rate else None
+        return ClientQuota(self.quantum, bucket)
+
+
+class Scheduler:
+
+    def __init__(self, config=None):
+        config = config or {}
+        quantum = config.get('quantum', DEFAULT_QUANTUM)
+        self.classes = [ClientClass(class_config.get('name', 'class-{}'.format(i)),
+                                    networks=class_config.get('networks', ()),
+                                    weight=class_config.get('weight', 1),
+                                    rate=class_config.get('rate'),
+                                    burst=class_config.get('burst'),
+                                    quantum=quantum)
+                        for i, class_config in enumerate(config.get('classes', []))]
+        self.default = ClientClass('default',
+                                   rate=config.get('rate'),
+                                   burst=config.get('burst'),
+                                   quantum=quantum)
+
+    def class_for(self, address):
+        try:
+            ip = ipaddress.ip_address(address[0])
+        except (TypeError, IndexError, ValueError):
+            return self.default
+        for client_class in self.classes:
+            if client_class.matches(ip):
+                return client_class
+        return self.default
+
+    def quota_for(self, address):
+        client_class = self.class_for(address)
+        logger.debug("Connection from %s scheduled in class %s",
+                     address, client_class.name)
+        return client_class.quota()
@@ -0,0 +1,169 @@
+"""Load shedding for when indexing cannot keep up with incoming lines.
+The load is the largest of the number of pending index requests and the
+mean indexing latency, each relative to its configured maximum, and of
+how full the queues of the outputs are. Above a load of 1, unparsed
+lines are sampled; above the severe load, unparsed lines are dropped
+and lines matched by low priority specs are sampled. Parsed lines of
+normal priority are never dropped.
+
+A TCP connection waits for each line to be indexed before it reads the
+next one, so there is at most one pending request per connection; for
+TCP, it is the latency, or the queues of the outputs, that signal an
+overload."""
+import time
+import logging
+
+import tornado.ioloop
+
+from .processor import LowPriority
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_PENDING = 1000
+DEFAULT_MAX_LATENCY = 1.0
+DEFAULT_SEVERE_LOAD = 2.0
+DEFAULT_UNPARSED_SAMPLE = 0.1
+DEFAULT_LOW_PRIORITY_SAMPLE = 0.5
+DEFAULT_REPORT_INTERVAL = 60
+DEFAULT_LATENCY_HALF_LIFE = 5
+#weight of the latest request in the mean latency
+LATENCY_WEIGHT = 0.1
+
+NORMAL = 0
+OVERLOADED = 1
+SEVERE = 2
+LEVEL_NAMES = ('normal', 'overloaded', 'severely overloaded')
+
+
+class Sampler:
+    """Keeps rate of the lines it is asked about, evenly spread"""
+
+    __slots__ = ('rate', 'credit')
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.credit = 0.0
+
+    def keep(self):
+        self.credit += self.rate
+        if self.credit >= 1.0:
+            self.credit -= 1.0
+            return True
+        return False
+
+
+class LoadShedder:
+
+    def __init__(self, config, io_loop=None):
+        config = config or {}
+        self.max_pending = config.get('max_pending', DEFAULT_MAX_PENDING)
+        self.max_latency = config.get('max_latency', DEFAULT_MAX_LATENCY)
+        self.latency_half_life = config.get('latency_half_life', DEFAULT_LATENCY_HALF_LIFE)
+        self.severe_load = config.get('severe_load', DEFAULT_SEVERE_LOAD)
+        self.unparsed = Sampler(config.get('unparsed_sample', DEFAULT_UNPARSED_SAMPLE))
+        self.low_priority = Sampler(config.get('low_priority_sample',
+                                               DEFAULT_LOW_PRIORITY_SAMPLE))
+        self.report_interval = config.get('report_interval', DEFAULT_REPORT_INTERVAL)
+        self.io_loop = io_loop or tornado.ioloop.IOLoop.current()
+        self.reporter = None
+        self.pending = 0
+        self.latency = 0.0
+        self.last_completion = time.monotonic()
+        self.level = NORMAL
+        self.queues = []
+        self.dropped_unparsed = 0
+        self.dropped_low_priority = 0
+
+    def watch(self, queue):
+        """Take the fill level of a tornado.queues.Queue into account"""
+        self.queues.append(queue)
+
+    def current_latency(self):
+        """The mean latency, which halves every latency_half_life seconds
+        while no requests are pending. Otherwise, it would stay high when
+        all lines are shed, as it only changes when requests complete."""
+        if self.pending or not self.latency:
+            return self.latency
+        idle = time.monotonic() - self.last_completion
+        return self.latency * 0.5 ** (idle / self.latency_half_life)
+
+    def load(self):
+        load = self.pending / self.max_pending if self.max_pending else 0.0
+        if self.max_latency:
+            load = max(load, self.current_latency() / self.max_latency)
+        for queue in self.queues:
+            #a full queue is a severe overload
+            if queue.maxsize:
+                load = max(load, queue.qsize() / queue.maxsize * self.severe_load)
+        return load
+
+    def _update_level(self):
+        load = self.load()
+        if load >= self.severe_load:
+            level = SEVERE
+        elif load >= 1.0:
+            level = OVERLOADED
+        else:
+            level = NORMAL
+        if level != self.level:
+            log = logger.warning if level > self.level else logger.info
+            log("Indexing is %s (load %.2f, %d pending, mean latency %.3f secs)",
+                LEVEL_NAMES[level], load, self.pending, self.current_latency())
+            self.level = level
+        return level
+
+    def admit(self, doc, parsed):
+        """Whether doc should be indexed; parsed is whether its line was
+        parsed"""
+        level = self._update_level()
+        if level == NORMAL:
+            return True
+        if not parsed:
+            if level == OVERLOADED and self.unparsed.keep():
+                return True
+            self.dropped_unparsed += 1
+            return False
+        if level == SEVERE and isinstance(doc, LowPriority) and not self.low_priority.keep():
+            self.dropped_low_priority += 1
+            return False
+        return True
+
+    async def track(self, request):
+        """Wait for the index request, an awaitable, keeping track of the
+        number of pending requests and their latency"""
+        if not self.pending:
+            #the time without pending requests, in which it decays, is over
+            self.latency = self.current_latency()
+        self.pending += 1
+        started = time.monotonic()
+        try:
+            result = await request
+        finally:
+            self.pending -= 1
+            now = time.monotonic()
+            self.latency += (now - started - self.latency) * LATENCY_WEIGHT
+            self.last_completion = now
+        return result
+
+    def stats(self):
+        return {'level': LEVEL_NAMES[self.level],
+                'pending': self.pending,
+                'latency': self.current_latency(),
+                'dropped_unparsed': self.dropped_unparsed,
+                'dropped_low_priority': self.dropped_low_priority}
+
+    def report(self):
+        if self.dropped_unparsed or self.dropped_low_priority or self.level != NORMAL:
+            logger.info("Load shedding: %(level)s, %(pending)d pending, mean latency "
+                        "%(latency).3f secs, dropped %(dropped_unparsed)d unparsed and "
+                        "%(dropped_low_priority)d low priority lines", self.stats())
+
+    def start(self):
+        self.reporter = tornado.ioloop.PeriodicCallback(
+            self.report, self.report_interval * 1000)
+        self.reporter.start()
+
+    def stop(self):
+        if self.reporter is not None:
+            self.reporter.stop()
+            self.reporter = None
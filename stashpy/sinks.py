@@ -0,0 +1,261 @@
+"""Outputs other than indexing one document at a time. A sink has a
+write coroutine that takes a list of (doc, key) tuples, where key
+identifies the line the document was made from as for
+ESIndexer.index, a flush coroutine that writes out whatever it buffers,
+and a close method. ESIndexer is a sink that sends bulk requests.
+
+Inputs hand documents to a BufferedOutput, which has its own queue
+and writes to its sink in batches, or to a FanOut of several
+BufferedOutputs, so that a slow sink does not hold up a fast one
+until its queue is full."""
+import os
+import gzip
+import json
+import time
+import logging
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+import tornado.ioloop
+import tornado.queues
+from tornado import gen
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUEUE_SIZE = 10000
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_FLUSH_INTERVAL = 1
+WAIT_WHEN_FULL = 'wait'
+DROP_WHEN_FULL = 'drop'
+
+DEFAULT_FILE_NAME = 'stashpy-%Y%m%dT%H%M%S.ndjson'
+DEFAULT_FILE_BUFFER_BYTES = 1024 * 1024
+DEFAULT_ROTATE_BYTES = 256 * 1024 * 1024
+DEFAULT_ROTATE_INTERVAL = 3600
+
+
+class NullSink:
+    """Discards documents, counting them; for benchmarking parsing"""
+
+    def __init__(self, config=None):
+        self.written = 0
+
+    async def write(self, items):
+        self.written += len(items)
+
+    async def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class NDJSONFileSink:
+    """Writes documents to NDJSON files in a directory, optionally gzipped.
+    Lines are collected in a buffer that is written in one go once it is
+    larger than buffer_bytes, in a separate thread. A new file is started
+    when the current one is larger than rotate_bytes, or older than
+    rotate_interval seconds."""
+
+    def __init__(self, config):
+        self.directory = config['directory']
+        self.file_name = config.get('file_name', DEFAULT_FILE_NAME)
+        self.compress = config.get('compress', False)
+        self.buffer_bytes = config.get('buffer_bytes', DEFAULT_FILE_BUFFER_BYTES)
+        self.rotate_bytes = config.get('rotate_bytes', DEFAULT_ROTATE_BYTES)
+        self.rotate_interval = config.get('rotate_interval', DEFAULT_ROTATE_INTERVAL)
+        os.makedirs(self.directory, exist_ok=True)
+        #a single thread, so that writes happen in order
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.buffer = []
+        self.buffered = 0
+        self.outfile = None
+        self.path = None
+        self.opened_at = None
+        self.file_bytes = 0
+        self.written = 0
+
+    def _new_path(self):
+        name = datetime.strftime(datetime.now(), self.file_name)
+        if self.compress:
+            name += '.gz'
+        path = os.path.join(self.directory, name)
+        base, extension = path, ''
+        if self.compress:
+            base, extension = path[:-3], '.gz'
+        count = 0
+        while os.path.exists(path):
+            count += 1
+            path = '{}.{}{}'.format(base, count, extension)
+        return path
+
+    def _open(self):
+        self.path = self._new_path()
+        if self.compress:
+            self.outfile = gzip.open(self.path, 'wb')
+        else:
+            self.outfile = open(self.path, 'wb')
+        self.opened_at = time.time()
+        self.file_bytes = 0
+        logger.info("Writing documents to %s", self.path)
+
+    def _close_file(self):
+        if self.outfile is not None:
+            self.outfile.close()
+            self.outfile = None
+
+    def _write_data(self, data):
+        """Write data to the current file, starting a new file first if it
+        is time to rotate. Runs in the writer thread."""
+        if self.outfile is not None and (
+                self.file_bytes >= self.rotate_bytes or
+                time.time() - self.opened_at >= self.rotate_interval):
+            self._close_file()
+        if self.outfile is None:
+            self._open()
+        self.outfile.write(data)
+        self.file_bytes += len(data)
+
+    async def write(self, items):
+        for doc, _key in items:
+            if '_index_' in doc:
+                doc = {key: value for key, value in doc.items() if key != '_index_'}
+            line = json.dumps(doc).encode('utf-8') + b'\n'
+            self.buffer.append(line)
+            self.buffered += len(line)
+        self.written += len(items)
+        if self.buffered >= self.buffer_bytes:
+            await self.flush()
+
+    async def flush(self):
+        if not self.buffer:
+            return
+        data = b''.join(self.buffer)
+        self.buffer = []
+        self.buffered = 0
+        await tornado.ioloop.IOLoop.current().run_in_executor(
+            self.executor, self._write_data, data)
+
+    def close(self):
+        if self.buffer:
+            self.executor.submit(self._write_data, b''.join(self.buffer))
+            self.buffer = []
+            self.buffered = 0
+        self.executor.submit(self._close_file)
+        self.executor.shutdown(wait=True)
+
+
+class BufferedOutput:
+    """Queues documents for a sink, and writes them to it in batches of at
+    most batch_size from a coroutine of its own. When the queue is full,
+    index waits for room, or drops the document if when_full is drop.
+    The sink is flushed at least every flush_interval seconds."""
+
+    def __init__(self, sink, config=None, io_loop=None):
+        config = config or {}
+        self.sink = sink
+        self.name = config.get('name', type(sink).__name__)
+        self.batch_size = config.get('batch_size', DEFAULT_BATCH_SIZE)
+        self.flush_interval = config.get('flush_interval', DEFAULT_FLUSH_INTERVAL)
+        self.when_full = config.get('when_full', WAIT_WHEN_FULL)
+        self.queue = tornado.queues.Queue(maxsize=config.get('queue_size', DEFAULT_QUEUE_SIZE))
+        self.io_loop = io_loop or tornado.ioloop.IOLoop.current()
+        self.dropped = 0
+        self.failed = 0
+        self.closing = False
+        self.last_flush = self.io_loop.time()
+        self.io_loop.add_future(gen.convert_yielded(self.run()), self._writer_done)
+
+    def _writer_done(self, future):
+        if future.exception() is not None:
+            logger.error("Writer for %s stopped: %s", self.name, future.exception())
+
+    async def index(self, doc, key=None):
+        """Queue doc, waiting for room if the queue is full"""
+        if not self.queue.full():
+            self.queue.put_nowait((doc, key))
+        elif self.when_full == DROP_WHEN_FULL:
+            self.dropped += 1
+            if self.dropped % 1000 == 1:
+                logger.warning("Queue of %s is full, dropped %d documents so far",
+                               self.name, self.dropped)
+        else:
+            await self.queue.put((doc, key))
+
+    async def _write(self, batch):
+        try:
+            await self.sink.write(batch)
+        except Exception:
+            self.failed += len(batch)
+            logger.exception("Writing %d documents to %s failed", len(batch), self.name)
+        finally:
+            for _ in batch:
+                self.queue.task_done()
+
+    async def _flush(self):
+        self.last_flush = self.io_loop.time()
+        try:
+            await self.sink.flush()
+        except Exception:
+            logger.exception("Flushing %s failed", self.name)
+
+    async def run(self):
+        while not self.closing:
+            try:
+                item = await self.queue.get(
+                    timeout=self.last_flush + self.flush_interval)
+            except gen.TimeoutError:
+                await self._flush()
+                continue
+            batch = [item]
+            while len(batch) < self.batch_size and self.queue.qsize():
+                batch.append(self.queue.get_nowait())
+            await self._write(batch)
+            if self.io_loop.time() - self.last_flush >= self.flush_interval:
+                await self._flush()
+
+    async def close(self):
+        """Write everything that is queued, and close the sink"""
+        await self.queue.join()
+        self.closing = True
+        await self._flush()
+        self.sink.close()
+
+
+class FanOut:
+    """Hands every document to each of outputs"""
+
+    def __init__(self, outputs):
+        self.outputs = outputs
+
+    async def index(self, doc, key=None):
+        await gen.multi([output.index(doc, key) for output in self.outputs])
+
+    async def close(self):
+        await gen.multi([output.close() for output in self.outputs])
+
+
+SINKS = {'file': NDJSONFileSink, 'null': NullSink}
+OUTPUT_KEYS = ('type', 'name', 'queue_size', 'batch_size', 'flush_interval', 'when_full')
+
+
+def load_outputs(configs, es_sink=None, io_loop=None):
+    """Create the outputs in configs, a list of dictionaries with the type
+    of the sink (file, null or elasticsearch), the options of its
+    BufferedOutput, and the options of the sink. es_sink is called with
+    the options of elasticsearch outputs to create their sinks."""
+    outputs = []
+    for config in configs:
+        sink_type = config['type']
+        sink_config = {key: value for key, value in config.items()
+                       if key not in OUTPUT_KEYS}
+        if sink_type == 'elasticsearch':
+            sink = es_sink(sink_config)
+        elif sink_type in SINKS:
+            sink = SINKS[sink_type](sink_config)
+        else:
+            raise ValueError("Unknown output type {}".format(sink_type))
+        outputs.append(BufferedOutput(sink, config, io_loop=io_loop))
+    if len(outputs) == 1:
+        return outputs[0]
+    return FanOut(outputs)
@@ -0,0 +1,78 @@
+"""Decoders for lines that are already structured, i.e. JSON objects and
+key=value (logfmt) lines. Each decoder first checks cheaply whether a
+line can be in its format, and returns None if it is not. Fields whose
+names start with an underscore are dropped, as they are reserved for
+Stashpy and ElasticSearch, e.g. _index_ chooses the index; clients must
+not be able to set them."""
+import json
+
+_decode_json = json.JSONDecoder().decode
+
+
+def decode_json(line):
+    stripped = line.strip()
+    if stripped[:1] != '{' or stripped[-1:] != '}':
+        return None
+    try:
+        decoded = _decode_json(stripped)
+    except ValueError:
+        return None
+    if not isinstance(decoded, dict):
+        return None
+    return {key: value for key, value in decoded.items() if not key.startswith('_')}
+
+
+def _is_key(key):
+    return key != '' and key.replace('_', '').replace('.', '').replace('-', '').isalnum()
+
+
+def decode_kv(line):
+    """Decode a line of space-separated key=value pairs, where values can
+    be double-quoted. Returns None unless the whole line consists of such
+    pairs."""
+    first_equals = line.find('=')
+    if first_equals < 1 or ' ' in line[:first_equals]:
+        return None
+    fields = {}
+    position, length = 0, len(line)
+    while position < length:
+        if line[position] == ' ':
+            position += 1
+            continue
+        equals = line.find('=', position)
+        if equals == -1:
+            return None
+        key = line[position:equals]
+        if not _is_key(key):
+            return None
+        position = equals + 1
+        if line.startswith('"', position):
+            value_parts = []
+            position += 1
+            while True:
+                quote = line.find('"', position)
+                if quote == -1:
+                    return None
+                backslash = line.find('\\', position, quote)
+                if backslash == -1:
+                    value_parts.append(line[position:quote])
+                    position = quote + 1
+                    break
+                value_parts.append(line[position:backslash])
+                value_parts.append(line[backslash + 1:backslash + 2])
+                position = backslash + 2
+            value = ''.join(value_parts)
+            if position < length and line[position] != ' ':
+                return None
+        else:
+            end = line.find(' ', position)
+            if end == -1:
+                end = length
+            value = line[position:end]
+            position = end
+        if key[0] != '_':
+            fields[key] = value
+    return fields or None
+
+
+DECODERS = {'json': decode_json, 'kv': decode_kv}
@@ -0,0 +1,139 @@
+"""Parsing of syslog headers in the RFC 5424 and RFC 3164 (BSD) formats.
+This is done with plain string operations instead of regular
+expressions, as it has to be done for every line."""
+from datetime import datetime
+
+SEVERITIES = ('emerg', 'alert', 'crit', 'err', 'warning', 'notice', 'info', 'debug')
+FACILITIES = ('kern', 'user', 'mail', 'daemon', 'auth', 'syslog', 'lpr', 'news',
+              'uucp', 'cron', 'authpriv', 'ftp', 'ntp', 'security', 'console',
+              'solaris-cron', 'local0', 'local1', 'local2', 'local3', 'local4',
+              'local5', 'local6', 'local7')
+MONTHS = {'Jan': 1, 'Feb': 2, 'Mar': 3, 'Apr': 4, 'May': 5, 'Jun': 6,
+          'Jul': 7, 'Aug': 8, 'Sep': 9, 'Oct': 10, 'Nov': 11, 'Dec': 12}
+NIL = '-'
+BOM = '\ufeff'
+#types of the header fields, for the generated index template
+FIELD_TYPES = {'severity': 'keyword', 'facility': 'keyword', 'host': 'keyword',
+               'app': 'keyword', 'procid': 'keyword', 'msgid': 'keyword',
+               'structured_data': 'str'}
+
+
+def _priority(line):
+    """Parse the <PRI> part. Returns the fields and the position after it,
+    or None if line does not start with a priority."""
+    if not line.startswith('<'):
+        return None
+    end = line.find('>', 1, 5)
+    if end == -1:
+        return None
+    pri = line[1:end]
+    if not pri.isdigit():
+        return None
+    pri = int(pri)
+    facility = pri >> 3
+    fields = {'severity': SEVERITIES[pri & 7],
+              'facility': FACILITIES[facility] if facility < len(FACILITIES) else str(facility)}
+    return fields, end + 1
+
+
+def _structured_data_end(line, pos):
+    """Return the position after the structured data starting at pos"""
+    if line.startswith(NIL, pos):
+        return pos + 1
+    length = len(line)
+    while pos < length and line[pos] == '[':
+        pos += 1
+        while pos < length:
+            char = line[pos]
+            if char == '\\':
+                pos += 2
+                continue
+            pos += 1
+            if char == ']':
+                break
+    return pos
+
+
+def parse_rfc5424(line, fields, pos):
+    #VERSION SP TIMESTAMP SP HOSTNAME SP APP-NAME SP PROCID SP MSGID SP SD [SP MSG]
+    parts = line[pos:].split(' ', 6)
+    if len(parts) < 7 or not parts[0].isdigit():
+        return None
+    _version, timestamp, host, app, procid, msgid, rest = parts
+    if timestamp != NIL:
+        fields['@timestamp'] = timestamp
+    for key, value in (('host', host), ('app', app), ('procid', procid), ('msgid', msgid)):
+        if value != NIL:
+            fields[key] = value
+    sd_end = _structured_data_end(rest, 0)
+    if sd_end > 1:
+        fields['structured_data'] = rest[:sd_end]
+    body = rest[sd_end + 1:]
+    if body.startswith(BOM):
+        body = body[1:]
+    return fields, body
+
+
+def _looks_like_rfc3164_timestamp(stamp):
+    day = stamp[4:6].strip()
+    hms = stamp[7:15]
+    return (stamp[:3] in MONTHS and day.isdigit() and
+            hms[2:3] == ':' and hms[5:6] == ':' and hms.replace(':', '').isdigit())
+
+
+def _rfc3164_timestamp(stamp, now):
+    month = MONTHS[stamp[:3]]
+    day = stamp[4:6].strip()
+    hms = stamp[7:15]
+    year = now.year
+    #messages from the last days of december arriving in january
+    if month > now.month + 1:
+        year -= 1
+    try:
+        timestamp = datetime(year, month, int(day),
+                             int(hms[0:2]), int(hms[3:5]), int(hms[6:8]))
+    except ValueError:
+        #e.g. Feb 30, or Feb 29 of a year that is not a leap year
+        return None
+    #RFC 3164 timestamps are in the local time of the sender, which is
+    #unknown, so no offset is added; ElasticSearch reads them as UTC
+    return timestamp.isoformat()
+
+
+def parse_rfc3164(line, fields, pos, now=None):
+    #Mmm dd hh:mm:ss HOSTNAME TAG[PID]: MSG
+    stamp = line[pos:pos + 15]
+    if not _looks_like_rfc3164_timestamp(stamp):
+        return None
+    timestamp = _rfc3164_timestamp(stamp, now or datetime.utcnow())
+    #an impossible date leaves @timestamp unset, so that the receive
+    #time is used
+    if timestamp is not None:
+        fields['@timestamp'] = timestamp
+    host_end = line.find(' ', pos + 16)
+    if host_end == -1:
+        return None
+    fields['host'] = line[pos + 16:host_end]
+    rest = line[host_end + 1:]
+    colon = rest.find(': ')
+    tag = rest[:colon] if colon != -1 else ''
+    if not tag or ' ' in tag:
+        return fields, rest
+    bracket = tag.find('[')
+    if bracket != -1 and tag.endswith(']'):
+        fields['procid'] = tag[bracket + 1:-1]
+        tag = tag[:bracket]
+    fields['app'] = tag
+    return fields, rest[colon + 2:]
+
+
+def parse_syslog_header(line, now=None):
+    """Split line into a dictionary of the fields in its syslog header, and
+    the message body. Returns None if line has no syslog header."""
+    priority = _priority(line)
+    if priority is None:
+        return None
+    fields, pos = priority
+    if line[pos:pos + 1].isdigit():
+        return parse_rfc5424(line, fields, pos)
+    return parse_rfc3164(line, fields, pos, now=now)
@@ -49,7 +49,7 @@ class StashpyTests(AsyncTestCase):
 
     @gen_test(timeout=MAX_TIMEOUT)
     def test_indexing_line(self):
-        client = AsyncHTTPClient(io_loop=self.io_loop)
+        client = AsyncHTTPClient()
         ping = yield client.fetch("http://localhost:9200/", raise_error=False)
         if ping.code != 200 or decode(ping)['tagline'] != "You Know, for Search":
             self.fail("This test requires an ES instance running on localhost")
@@ -59,7 +59,7 @@ class StashpyTests(AsyncTestCase):
         resp = yield client.fetch(url, method='DELETE', headers=None, raise_error=False)
 
         app = App(CONFIG)
-        app.run()
+        app.start()
 
         s = socket.socket(socket.AF_INET, socket.SOCK_STREAM, 0)
         stream = IOStream(s)
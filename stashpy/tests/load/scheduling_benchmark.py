@@ -0,0 +1,77 @@
+"""Measures the per-line overhead of reading lines from a connection and
+handing them to the indexer, i.e. everything a ConnectionHandler does
+apart from parsing. Lines are sent over a socketpair to a handler with
+an indexer that does nothing; the time it takes to make the documents
+alone is subtracted. Run this file directly, optionally with the event
+loops to compare, e.g. python scheduling_benchmark.py asyncio uvloop"""
+import sys
+import time
+import socket
+import threading
+
+import tornado.ioloop
+from tornado.iostream import IOStream
+
+LINES = 200000
+LINE = b"My name is Yuri and I'm 6 years old.\n"
+SPECS = {'to_dict': ["My name is {name} and I'm {age:d} years old."]}
+
+
+class NullIndexer:
+    async def index(self, doc, key=None):
+        pass
+
+
+def send_lines(sock, count):
+    data = LINE * 1000
+    for _ in range(count // 1000):
+        sock.sendall(data)
+    sock.shutdown(socket.SHUT_WR)
+
+
+def time_documents(line_processor, count):
+    from stashpy.processor import make_document
+    line = LINE.decode('utf-8').rstrip('\n')
+    started = time.perf_counter()
+    for _ in range(count):
+        make_document(line_processor, line)
+    return time.perf_counter() - started
+
+
+def time_handler(line_processor, count):
+    from stashpy.handler import ConnectionHandler
+    server_sock, client_sock = socket.socketpair()
+    handler = ConnectionHandler(IOStream(server_sock), ('benchmark', 0),
+                                NullIndexer(), line_processor)
+    sender = threading.Thread(target=send_lines, args=(client_sock, count))
+    io_loop = tornado.ioloop.IOLoop.current()
+    started = time.perf_counter()
+    sender.start()
+    io_loop.run_sync(handler.on_connect)
+    elapsed = time.perf_counter() - started
+    sender.join()
+    client_sock.close()
+    return elapsed
+
+
+def run(event_loop):
+    from stashpy.eventloop import install_event_loop
+    from stashpy.processor import LineProcessor
+    install_event_loop(event_loop)
+    line_processor = LineProcessor(SPECS)
+    #warm up
+    time_handler(line_processor, 10000)
+    documents = time_documents(line_processor, LINES)
+    handler = time_handler(line_processor, LINES)
+    print("{:>8}: {:.2f} us/line in total, {:.2f} us/line of scheduling overhead".format(
+        event_loop, handler / LINES * 1e6, (handler - documents) / LINES * 1e6))
+
+
+if __name__ == "__main__":
+    for event_loop in sys.argv[1:] or ['asyncio']:
+        #each event loop in a fresh process, as it can only be installed once
+        if len(sys.argv) > 2:
+            import subprocess
+            subprocess.check_call([sys.executable, __file__, event_loop])
+        else:
+            run(event_loop)
@@ -0,0 +1,61 @@
+"""Opens and closes many connections to an in-process stashpy without
+ElasticSearch, and checks that the resident memory does not grow. Run
+this file directly; it needs a Linux /proc filesystem."""
+import gc
+import os
+import socket
+import unittest
+
+from tornado.testing import AsyncTestCase, gen_test
+from tornado.iostream import IOStream
+from tornado import gen
+
+from stashpy.main import App
+
+CONFIG = {
+    'processor_spec': {'to_dict': ["My name is {name} and I'm {age:d} years old."]},
+    'port': 8898,
+    'address': 'localhost',
+}
+
+WARMUP_CONNECTIONS = 1000
+SOAK_CONNECTIONS = 10000
+#Some growth is unavoidable due to allocator fragmentation
+MAX_RSS_GROWTH = 4 * 1024 * 1024
+
+
+def rss_bytes():
+    with open('/proc/self/statm', 'r') as statm:
+        resident_pages = int(statm.read().split()[1])
+    return resident_pages * os.sysconf('SC_PAGE_SIZE')
+
+
+class SoakTest(AsyncTestCase):
+
+    @gen.coroutine
+    def open_and_close(self, count):
+        for _ in range(count):
+            stream = IOStream(socket.socket(socket.AF_INET, socket.SOCK_STREAM, 0))
+            yield stream.connect((CONFIG['address'], CONFIG['port']))
+            yield stream.write(b"My name is Yuri and I'm 6 years old.\n")
+            stream.close()
+        #let the server notice the last closes
+        yield gen.sleep(0.5)
+
+    @gen_test(timeout=600)
+    def test_rss_stays_flat(self):
+        app = App(CONFIG)
+        app.start()
+        yield self.open_and_close(WARMUP_CONNECTIONS)
+        gc.collect()
+        baseline = rss_bytes()
+        yield self.open_and_close(SOAK_CONNECTIONS)
+        gc.collect()
+        growth = rss_bytes() - baseline
+        self.assertEqual(len(app.main.connections), 0)
+        self.assertLess(growth, MAX_RSS_GROWTH,
+                        "RSS grew by {} bytes over {} connections".format(
+                            growth, SOAK_CONNECTIONS))
+
+if __name__ == "__main__":
+    unittest.main()
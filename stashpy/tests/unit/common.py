@@ -3,6 +3,18 @@ from datetime import datetime, timedelta
 import pytz
 import dateutil.parser
 
+
+class RecordingIndexer:
+    """Keeps the documents it is asked to index, and their keys"""
+
+    def __init__(self):
+        self.indexed = []
+        self.keys = []
+
+    async def index(self, doc, key=None):
+        self.indexed.append(doc)
+        self.keys.append(key)
+
 class TimeStampedMixin:
 
     def assertDictEqualWithTimestamp(self, dict1, dict2, timestamp_key='@timestamp'):
@@ -0,0 +1,105 @@
+import os
+import gzip
+import json
+import shutil
+import tempfile
+import unittest
+
+from stashpy import batch
+
+CONFIG = {'processor_spec': {'to_dict': ["My name is {name} and I'm {age:d} years old."]}}
+
+
+class ChunkTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def write(self, name, data):
+        path = os.path.join(self.directory, name)
+        with open(path, 'wb') as outfile:
+            outfile.write(data)
+        return path
+
+    def test_chunks_split_on_lines(self):
+        data = b"".join("line number {}\n".format(i).encode('utf-8') for i in range(100))
+        path = self.write('test.log', data)
+        lines = []
+        for chunk in batch.file_chunks(path, chunk_bytes=37):
+            lines.extend(batch.read_chunk_lines(*chunk))
+        self.assertEqual(b"".join(lines), data)
+
+    def test_chunk_boundary_at_newline(self):
+        path = self.write('test.log', b"abc\ndef\n")
+        self.assertListEqual(batch.read_chunk_lines(path, 0, 4), [b"abc\n"])
+        self.assertListEqual(batch.read_chunk_lines(path, 4, 8), [b"def\n"])
+
+    def test_stream_chunks(self):
+        chunks = list(batch.stream_chunks(iter([b"a\n", b"b\n", b"c\n"]), chunk_lines=2))
+        self.assertListEqual(chunks, [[b"a\n", b"b\n"], [b"c\n"]])
+
+
+class ProcessChunkTests(unittest.TestCase):
+
+    def test_ndjson(self):
+        batch._init_worker(CONFIG, 'ndjson', 'stashpy-%Y', 'doc', 10)
+        lines, parsed, blocks = batch.process_chunk(
+            [b"My name is Yuri and I'm 6 years old.\n", b"Something else\n"])
+        self.assertEqual((lines, parsed), (2, 1))
+        docs = [json.loads(line) for line in blocks[0].splitlines()]
+        self.assertEqual(docs[0]['name'], 'Yuri')
+        self.assertEqual(docs[1]['message'], 'Something else')
+
+    def test_bulk(self):
+        batch._init_worker(CONFIG, 'bulk', 'kita-{name}', 'doc', 2)
+        _, _, blocks = batch.process_chunk(
+            [b"My name is Yuri and I'm 6 years old.\n"] * 3)
+        self.assertEqual(len(blocks), 2)
+        first = blocks[0].splitlines()
+        self.assertEqual(len(first), 4)
+        self.assertDictEqual(json.loads(first[0]),
+                             {'index': {'_index': 'kita-Yuri', '_type': 'doc'}})
+
+    def test_hash_ids(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'test.log')
+        with open(path, 'wb') as outfile:
+            outfile.write(b"My name is Yuri and I'm 6 years old.\n" * 10)
+        config = dict(CONFIG, indexer_config={'id_strategy': 'hash'})
+        batch._init_worker(config, 'bulk', 'kita', 'doc', 100)
+        ids = []
+        for chunk_bytes in (50, 200):
+            chunk_ids = []
+            for chunk in batch.file_chunks(path, chunk_bytes):
+                for block in batch.process_chunk(chunk)[2]:
+                    chunk_ids.extend(json.loads(line)['index']['_id']
+                                     for line in block.splitlines()[::2])
+            ids.append(chunk_ids)
+        #the same lines get the same IDs regardless of how the file is split
+        self.assertEqual(len(set(ids[0])), 10)
+        self.assertListEqual(ids[0], ids[1])
+
+
+class BackfillTests(unittest.TestCase):
+
+    def test_backfill_to_ndjson(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        plain = os.path.join(directory, 'plain.log')
+        with open(plain, 'wb') as outfile:
+            outfile.write(b"My name is Yuri and I'm 6 years old.\n" * 50)
+        zipped = os.path.join(directory, 'zipped.log.gz')
+        with gzip.open(zipped, 'wb') as outfile:
+            outfile.write(b"My name is Lilith and I'm 4 years old.\n" * 30)
+        output = os.path.join(directory, 'out')
+        total = batch.backfill(CONFIG, [plain, zipped], output=output, workers=2,
+                               chunk_bytes=100, chunk_lines=7)
+        self.assertEqual(total, 80)
+        with open(os.path.join(output, 'plain.log.ndjson')) as infile:
+            self.assertEqual(len(infile.readlines()), 50)
+        with open(os.path.join(output, 'zipped.log.ndjson')) as infile:
+            docs = [json.loads(line) for line in infile]
+        self.assertEqual(len(docs), 30)
+        self.assertEqual(docs[0]['name'], 'Lilith')
@@ -0,0 +1,49 @@
+import gzip
+import zlib
+import unittest
+
+from tornado.testing import AsyncTestCase, gen_test
+
+from stashpy.compression import Compressor, compress
+
+BODY = b'{"message": "My name is Lilith and I\'m 4 years old."}\n' * 100
+
+
+class CompressTests(unittest.TestCase):
+
+    def test_gzip(self):
+        self.assertEqual(gzip.decompress(compress(BODY, 'gzip')), BODY)
+
+    def test_deflate(self):
+        self.assertEqual(zlib.decompress(compress(BODY, 'deflate', 1)), BODY)
+
+    def test_unknown_encoding(self):
+        with self.assertRaises(ValueError):
+            Compressor({'encoding': 'brotli'})
+
+
+class CompressorTests(AsyncTestCase):
+
+    def test_min_bytes(self):
+        compressor = Compressor({'min_bytes': len(BODY) + 1})
+        self.assertEqual(compressor.compress(BODY), (BODY, {}))
+        self.assertEqual(compressor.stats()['compressed'], 0)
+
+    def test_stats(self):
+        compressor = Compressor('gzip')
+        body, headers = compressor.compress(BODY.decode('utf-8'))
+        self.assertDictEqual(headers, {'Content-Encoding': 'gzip'})
+        stats = compressor.stats()
+        self.assertEqual(stats['compressed'], 1)
+        self.assertAlmostEqual(stats['ratio'], len(body) / len(BODY))
+        self.assertLess(stats['ratio'], 0.1)
+
+    @gen_test
+    def test_compress_async(self):
+        compressor = Compressor({'encoding': 'deflate', 'level': 9})
+        self.addCleanup(compressor.close)
+        body, headers = yield compressor.compress_async(BODY)
+        self.assertEqual(zlib.decompress(body), BODY)
+        self.assertEqual(headers['Content-Encoding'], 'deflate')
+        small, headers = yield compressor.compress_async('{}')
+        self.assertEqual((small, headers), (b'{}', {}))
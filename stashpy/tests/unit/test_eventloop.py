@@ -0,0 +1,64 @@
+import sys
+import unittest
+import subprocess
+
+from stashpy.eventloop import install_event_loop
+
+#installing an event loop cannot be undone, so this runs in another process
+APP_SCRIPT = """
+import os
+import sys
+import signal
+import socket
+from tornado.testing import bind_unused_port
+from stashpy.eventloop import install_event_loop
+from stashpy.main import App
+
+io_loop = install_event_loop(sys.argv[1])
+sock, port = bind_unused_port()
+sock.close()
+app = App({'processor_spec': {'to_dict': ["My name is {name}."]},
+           'address': '127.0.0.1', 'port': port, 'outputs': [{'type': 'null'}]})
+
+def send_lines():
+    client_sock = socket.create_connection(('127.0.0.1', port))
+    client_sock.sendall(b"My name is Yuri.\\nMy name is Lilith.\\n")
+    client_sock.close()
+    io_loop.call_later(0.2, os.kill, os.getpid(), signal.SIGTERM)
+
+io_loop.add_callback(send_lines)
+app.run()
+print(type(io_loop.asyncio_loop).__name__, app.main.indexer.sink.written)
+"""
+
+
+def run_app(event_loop):
+    output = subprocess.check_output([sys.executable, '-c', APP_SCRIPT, event_loop],
+                                     timeout=10)
+    return output.decode('utf-8').split()
+
+
+class EventLoopTests(unittest.TestCase):
+
+    def test_asyncio(self):
+        self.assertListEqual(run_app('asyncio'), ['_UnixSelectorEventLoop', '2'])
+
+    def test_uvloop(self):
+        try:
+            import uvloop
+        except ImportError:
+            self.skipTest("uvloop is not installed")
+        self.assertListEqual(run_app('uvloop'), ['Loop', '2'])
+
+    def test_unknown_policy(self):
+        with self.assertRaises(ImportError):
+            install_event_loop('stashpy.nonexistent.Policy')
+
+    def test_uvloop_missing(self):
+        try:
+            import uvloop
+        except ImportError:
+            with self.assertRaises(RuntimeError):
+                install_event_loop('uvloop')
+        else:
+            self.skipTest("uvloop is installed")
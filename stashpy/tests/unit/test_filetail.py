@@ -0,0 +1,170 @@
+import os
+import json
+import shutil
+import tempfile
+
+from tornado.testing import AsyncTestCase, gen_test
+
+from stashpy.processor import LineProcessor
+from stashpy.filetail import FileTailer
+from .common import RecordingIndexer
+
+SAMPLE_PARSE = "My name is {name} and I'm {age:d} years old."
+
+
+class FileTailerTests(AsyncTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.log_path = os.path.join(self.directory, 'app.log')
+        self.checkpoint_path = os.path.join(self.directory, 'checkpoints.json')
+        self.tailers = []
+
+    def tearDown(self):
+        for tailer in self.tailers:
+            tailer.stop()
+        super().tearDown()
+
+    def make_tailer(self, **config):
+        config.setdefault('paths', [os.path.join(self.directory, '*.log')])
+        config.setdefault('checkpoint_path', self.checkpoint_path)
+        config.setdefault('start_position', 'beginning')
+        indexer = RecordingIndexer()
+        tailer = FileTailer(config, indexer,
+                            LineProcessor({'to_dict': [SAMPLE_PARSE]}),
+                            io_loop=self.io_loop)
+        self.tailers.append(tailer)
+        return tailer, indexer
+
+    def write(self, data, mode='ab', path=None):
+        with open(path or self.log_path, mode) as log_file:
+            log_file.write(data)
+
+    def messages(self, indexer):
+        return [doc['message'] for doc in indexer.indexed]
+
+    @gen_test
+    def test_read_lines(self):
+        self.write(b"My name is Yuri and I'm 6 years old.\nsecond\npartial")
+        tailer, indexer = self.make_tailer()
+        yield tailer.poll()
+        self.assertListEqual(self.messages(indexer),
+                             ["My name is Yuri and I'm 6 years old.", "second"])
+        self.assertEqual(indexer.indexed[0]['name'], 'Yuri')
+        self.write(b" line\n")
+        yield tailer.poll()
+        self.assertEqual(self.messages(indexer)[-1], "partial line")
+
+    @gen_test
+    def test_start_at_end(self):
+        self.write(b"old line\n")
+        tailer, indexer = self.make_tailer(start_position='end')
+        yield tailer.poll()
+        self.write(b"new line\n")
+        yield tailer.poll()
+        self.assertListEqual(self.messages(indexer), ["new line"])
+
+    @gen_test
+    def test_resume_from_checkpoint(self):
+        self.write(b"first\nsec")
+        tailer, indexer = self.make_tailer()
+        yield tailer.poll()
+        tailer.stop()
+        with open(self.checkpoint_path, 'r') as checkpoint_file:
+            self.assertEqual(json.load(checkpoint_file)[self.log_path]['offset'], 6)
+        self.write(b"ond\nthird\n")
+        tailer, indexer = self.make_tailer()
+        yield tailer.poll()
+        self.assertListEqual(self.messages(indexer), ["second", "third"])
+
+    @gen_test
+    def test_rotation(self):
+        self.write(b"first\n")
+        tailer, indexer = self.make_tailer(paths=[self.log_path])
+        yield tailer.poll()
+        self.write(b"last in old file\n")
+        os.rename(self.log_path, self.log_path + '.1')
+        self.write(b"first in new file\n")
+        yield tailer.poll()
+        self.assertListEqual(self.messages(indexer),
+                             ["first", "last in old file", "first in new file"])
+
+    @gen_test
+    def test_rotation_to_matching_path(self):
+        self.write(b"one\ntwo\n")
+        tailer, indexer = self.make_tailer(paths=[self.log_path + '*'])
+        yield tailer.poll()
+        first_key = indexer.keys[0]
+        self.write(b"still old\n")
+        os.rename(self.log_path, self.log_path + '.1')
+        self.write(b"three\n")
+        yield tailer.poll()
+        yield tailer.poll()
+        self.assertListEqual(self.messages(indexer), ["one", "two", "still old", "three"])
+        self.assertSetEqual(set(tailer.files), {self.log_path, self.log_path + '.1'})
+        self.write(b"late\n", path=self.log_path + '.1')
+        yield tailer.poll()
+        self.assertEqual(self.messages(indexer)[-1], "late")
+        #the rotated file keeps its source, so that its document IDs do not change
+        self.assertEqual(indexer.keys[-1][0], first_key[0])
+        tailer.stop()
+        with open(self.checkpoint_path, 'r') as checkpoint_file:
+            saved = json.load(checkpoint_file)
+        self.assertEqual(saved[self.log_path + '.1']['source'], first_key[0])
+
+    @gen_test
+    def test_rotation_during_restart(self):
+        self.write(b"first\n")
+        tailer, indexer = self.make_tailer(paths=[self.log_path], start_position='end')
+        yield tailer.poll()
+        self.write(b"second\n")
+        yield tailer.poll()
+        tailer.stop()
+        os.rename(self.log_path, self.log_path + '.1')
+        self.write(b"written while down\n")
+        tailer, indexer = self.make_tailer(paths=[self.log_path], start_position='end')
+        yield tailer.poll()
+        self.assertListEqual(self.messages(indexer), ["written while down"])
+
+    @gen_test
+    def test_truncation(self):
+        self.write(b"a long first line\n")
+        tailer, indexer = self.make_tailer()
+        yield tailer.poll()
+        self.write(b"short\n", mode='wb')
+        yield tailer.poll()
+        self.assertListEqual(self.messages(indexer), ["a long first line", "short"])
+
+    @gen_test
+    def test_batches(self):
+        self.write(b"".join("line {}\n".format(i).encode('utf-8') for i in range(25)))
+        tailer, indexer = self.make_tailer(batch_size=10, read_size=7)
+        yield tailer.poll()
+        self.assertEqual(len(indexer.indexed), 25)
+        self.assertEqual(indexer.indexed[-1]['message'], "line 24")
+
+    @gen_test
+    def test_keys(self):
+        self.write(b"first\nsecond\nthird\n")
+        tailer, indexer = self.make_tailer(read_size=4)
+        yield tailer.poll()
+        inode = os.stat(self.log_path).st_ino
+        source = '{}:{}'.format(self.log_path, inode)
+        self.assertListEqual(indexer.keys, [(source, 0, "first"),
+                                            (source, 6, "second"),
+                                            (source, 13, "third")])
+
+    @gen_test
+    def test_keys_after_truncated_line(self):
+        self.write(b"first line\nsecond\nab\n")
+        inode = os.stat(self.log_path).st_ino
+        source = '{}:{}'.format(self.log_path, inode)
+        for read_size in [1024, 4]:
+            tailer, indexer = self.make_tailer(read_size=read_size, max_line_bytes=5,
+                                               checkpoint_path=None)
+            yield tailer.poll()
+            self.assertListEqual(indexer.keys, [(source, 0, "first"),
+                                                (source, 11, "secon"),
+                                                (source, 18, "ab")])
@@ -0,0 +1,60 @@
+import unittest
+
+from stashpy.framing import LineFramer, BufferBudget
+
+
+class LineFramerTests(unittest.TestCase):
+
+    def test_split_lines(self):
+        framer = LineFramer(100)
+        self.assertListEqual(framer.feed(b"first\nsecond\nthi"),
+                             [(b"first", False), (b"second", False)])
+        self.assertListEqual(framer.feed(b"rd\n"), [(b"third", False)])
+        self.assertEqual(framer.buffered, 0)
+
+    def test_truncate_long_line(self):
+        framer = LineFramer(5)
+        self.assertListEqual(framer.feed(b"abcdefgh\nok\n"),
+                             [(b"abcde", True), (b"ok", False)])
+
+    def test_discard_rest_of_long_line(self):
+        framer = LineFramer(5)
+        self.assertListEqual(framer.feed(b"abcdefgh"), [(b"abcde", True)])
+        self.assertEqual(framer.buffered, 0)
+        self.assertListEqual(framer.feed(b"ijklmnop"), [])
+        self.assertEqual(framer.buffered, 0)
+        self.assertListEqual(framer.feed(b"qr\nnext\n"), [(b"next", False)])
+
+    def test_flush(self):
+        framer = LineFramer(100)
+        framer.feed(b"no newline")
+        self.assertEqual(framer.flush(), (b"no newline", False))
+        self.assertIsNone(framer.flush())
+
+    def test_peak_buffered(self):
+        framer = LineFramer(100)
+        framer.feed(b"0123456789")
+        framer.feed(b"\n")
+        self.assertEqual(framer.peak_buffered, 11)
+
+
+class BufferBudgetTests(unittest.TestCase):
+
+    def test_accounting(self):
+        budget = BufferBudget(100)
+        framer = LineFramer(100, budget=budget)
+        framer.feed(b"partial")
+        self.assertEqual(budget.total, 7)
+        framer.feed(b" line\n")
+        self.assertEqual(budget.total, 0)
+        framer.feed(b"again")
+        framer.release()
+        self.assertEqual(budget.total, 0)
+
+    def test_truncate_when_exhausted(self):
+        budget = BufferBudget(10)
+        first = LineFramer(100, budget=budget)
+        second = LineFramer(100, budget=budget)
+        self.assertListEqual(first.feed(b"12345678"), [])
+        self.assertListEqual(second.feed(b"abcdef"), [(b"abcdef", True)])
+        self.assertEqual(budget.total, 8)
@@ -0,0 +1,75 @@
+import unittest
+
+from stashpy.geoip import GeoIPStage, to_fields
+
+BERLIN = {'city': {'names': {'en': 'Berlin'}},
+          'continent': {'code': 'EU', 'names': {'en': 'Europe'}},
+          'country': {'iso_code': 'DE', 'names': {'en': 'Germany'}},
+          'location': {'latitude': 52.52, 'longitude': 13.40,
+                       'time_zone': 'Europe/Berlin'},
+          'subdivisions': [{'iso_code': 'BE', 'names': {'en': 'Land Berlin'}}]}
+
+class MockReader:
+    def __init__(self):
+        self.calls = 0
+
+    def get(self, ip):
+        self.calls += 1
+        if ip == 'not an ip':
+            raise ValueError(ip)
+        if ip.startswith('62.'):
+            return BERLIN
+        return None
+
+
+class GeoIPTests(unittest.TestCase):
+
+    def test_to_fields(self):
+        self.assertDictEqual(to_fields('62.73.84.230', BERLIN),
+                             {'ip': '62.73.84.230', 'latitude': 52.52, 'longitude': 13.40,
+                              'location': [13.40, 52.52], 'timezone': 'Europe/Berlin',
+                              'country_code2': 'DE', 'country_name': 'Germany',
+                              'continent_code': 'EU', 'city_name': 'Berlin',
+                              'region_name': 'Land Berlin'})
+
+    def test_enrich(self):
+        stage = GeoIPStage({'fields': ['clientip']}, reader=MockReader())
+        doc = stage({'clientip': '62.73.84.230'})
+        self.assertEqual(doc['geoip']['city_name'], 'Berlin')
+
+    def test_unknown_and_invalid(self):
+        stage = GeoIPStage({'fields': ['clientip']}, reader=MockReader())
+        self.assertDictEqual(stage({'clientip': '10.0.0.1'}), {'clientip': '10.0.0.1'})
+        self.assertDictEqual(stage({'clientip': 'not an ip'}), {'clientip': 'not an ip'})
+        self.assertDictEqual(stage({'other': 1}), {'other': 1})
+
+    def test_not_a_string(self):
+        stage = GeoIPStage({'fields': ['clientip', 'remote_addr']}, reader=MockReader())
+        for value in [['62.73.84.230'], {'ip': '62.73.84.230'}, 62]:
+            doc = stage({'clientip': value, 'remote_addr': '62.73.84.230'})
+            self.assertEqual(doc['clientip'], value)
+            self.assertEqual(doc['geoip']['ip'], '62.73.84.230')
+
+    def test_first_field_found(self):
+        stage = GeoIPStage({'fields': ['forwarded_for', 'remote_addr'], 'target': 'geo'},
+                           reader=MockReader())
+        doc = stage({'forwarded_for': '10.0.0.1', 'remote_addr': '62.73.84.230'})
+        self.assertEqual(doc['geo']['ip'], '62.73.84.230')
+
+    def test_cache(self):
+        reader = MockReader()
+        stage = GeoIPStage({'fields': ['clientip'], 'cache_size': 2}, reader=reader)
+        for _ in range(3):
+            stage({'clientip': '62.73.84.230'})
+        stage({'clientip': '62.1.1.1'})
+        self.assertEqual(reader.calls, 2)
+        stats = stage.stats()
+        self.assertEqual(stats['lookups'], 4)
+        self.assertEqual(stats['hit_rate'], 0.5)
+
+    def test_documents_do_not_share_fields(self):
+        stage = GeoIPStage({'fields': ['clientip']}, reader=MockReader())
+        first = stage({'clientip': '62.73.84.230'})
+        second = stage({'clientip': '62.73.84.230'})
+        first['geoip']['city_name'] = 'Changed'
+        self.assertEqual(second['geoip']['city_name'], 'Berlin')
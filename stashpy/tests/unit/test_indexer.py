@@ -1,10 +1,18 @@
+import io
+import gzip
 import unittest
+from unittest import mock
+import tornado.httpclient
+from tornado import gen
+from tornado.testing import AsyncTestCase, gen_test
 from datetime import datetime, timedelta
 import json
 import copy
 
 import stashpy
-from stashpy.indexer import ESIndexer
+from stashpy.indexer import (ESIndexer, build_template, index_glob, template_name,
+                             document_ids, content_id, INDEX_TEMPLATE)
+from stashpy.processor import LineProcessor
 from .common import TimeStampedMixin
 
 class IndexerTests(unittest.TestCase, TimeStampedMixin):
@@ -101,3 +109,212 @@ class IndexerTests(unittest.TestCase, TimeStampedMixin):
         self.assertTrue(request.url.startswith(url_prefix))
         doc.pop('_index_')
         self.assertDictEqualWithTimestamp(self.request_body(request), doc)
+
+
+class TemplateTests(unittest.TestCase):
+
+    def test_index_glob(self):
+        self.assertEqual(index_glob('stashpy-%Y-%m-%d'), 'stashpy-*')
+        self.assertEqual(index_glob('kita-{name}-%Y'), 'kita-*')
+        self.assertEqual(index_glob('kita'), 'kita')
+
+    def test_field_types(self):
+        processor = LineProcessor({'to_dict': [
+            "My name is {name} and I'm {age:d} years old, {height:.2f}m tall",
+            "%{IPORHOST:clientip} took %{NUMBER:duration:float} %{WORD:name}"]})
+        self.assertDictEqual(processor.field_types(),
+                             {'name': 'str', 'age': 'int', 'height': 'float',
+                              'clientip': 'str', 'duration': 'float'})
+
+    def test_conflicting_types(self):
+        processor = LineProcessor({'to_dict': ["{age:d} years", "age {age}"]})
+        self.assertDictEqual(processor.field_types(), {'age': 'str'})
+
+    def test_build_template(self):
+        template = build_template('kita-%Y', {'name': 'str', 'age': 'int',
+                                              'height': 'float', 'tag': 'str',
+                                              'payload': 'str'},
+                                  keyword=['tag'], not_indexed=['payload'])
+        self.assertEqual(template['template'], 'kita-*')
+        self.assertEqual(template_name(template), 'stashpy_kita')
+        properties = template['mappings']['_default_']['properties']
+        self.assertEqual(properties['age'], {'type': 'long'})
+        self.assertEqual(properties['height'], {'type': 'double'})
+        self.assertEqual(properties['tag']['index'], 'not_analyzed')
+        self.assertEqual(properties['payload'], {'type': 'string', 'index': 'no'})
+        self.assertEqual(properties['name']['index'], 'analyzed')
+        self.assertEqual(properties['@timestamp'], {'type': 'date'})
+        #the catch-all template is not modified
+        self.assertNotIn('age', INDEX_TEMPLATE['mappings']['_default_']['properties'])
+
+    def test_indexer_with_template(self):
+        template = build_template('kita-%Y', {'age': 'int'})
+        indexer = ESIndexer('localhost', 9200, index_pattern='kita-%Y',
+                            template=template)
+        request = indexer._create_request({'age': 4})
+        self.assertIn('/kita-', request.url)
+
+
+class DocumentIDTests(unittest.TestCase):
+
+    def test_auto(self):
+        indexer = ESIndexer('localhost', 9200, id_strategy='auto')
+        request = indexer._create_request({'name': 'Lilith'})
+        self.assertEqual(request.method, 'POST')
+        self.assertTrue(request.url.endswith('/doc/'))
+
+    def test_sequence(self):
+        document_id = document_ids('sequence')
+        first, second = document_id(None), document_id(None)
+        self.assertNotEqual(first, second)
+        self.assertEqual(first[:16], second[:16])
+        self.assertNotEqual(document_ids('sequence')(None)[:16], first[:16])
+
+    def test_hash(self):
+        indexer = ESIndexer('localhost', 9200, id_strategy='hash')
+        key = ('app.log:12', 120, 'a line')
+        first = indexer._create_request({'message': 'a line'}, key)
+        second = indexer._create_request({'message': 'a line'}, key)
+        self.assertEqual(first.method, 'PUT')
+        self.assertEqual(first.url, second.url)
+        self.assertTrue(first.url.endswith('/' + content_id(*key)))
+        other = indexer._create_request({'message': 'a line'}, ('app.log:12', 127, 'a line'))
+        self.assertNotEqual(first.url, other.url)
+
+    def test_unknown_strategy(self):
+        with self.assertRaises(ValueError):
+            document_ids('random')
+
+
+class FailingClient:
+
+    def __init__(self, failures, code=503):
+        self.failures = failures
+        self.code = code
+        self.requests = []
+        self.body = b''
+
+
+    @gen.coroutine
+    def fetch(self, request):
+        if '/_template/' in request.url:
+            return tornado.httpclient.HTTPResponse(
+                request, 200, buffer=io.BytesIO(b'{"stashpy_template": {}}'))
+        self.requests.append(request)
+        if len(self.requests) <= self.failures:
+            raise tornado.httpclient.HTTPError(self.code)
+        return tornado.httpclient.HTTPResponse(request, 201, buffer=io.BytesIO(self.body))
+
+
+class BulkClient:
+    """Answers bulk requests with the per-item statuses in responses, one
+    list per request"""
+
+    def __init__(self, responses):
+        self.responses = responses
+        self.requests = []
+
+    @gen.coroutine
+    def fetch(self, request):
+        if '/_template/' in request.url:
+            return tornado.httpclient.HTTPResponse(
+                request, 200, buffer=io.BytesIO(b'{"stashpy_template": {}}'))
+        self.requests.append(request)
+        statuses = self.responses[len(self.requests) - 1]
+        body = {'errors': any(status >= 300 for status in statuses),
+                'items': [{'index': {'status': status}} for status in statuses]}
+        return tornado.httpclient.HTTPResponse(
+            request, 200, buffer=io.BytesIO(json.dumps(body).encode('utf-8')))
+
+
+class RetryTests(AsyncTestCase, TimeStampedMixin):
+
+    def make_indexer(self, client, **kwargs):
+        with mock.patch('tornado.httpclient.AsyncHTTPClient', return_value=client):
+            indexer = ESIndexer('localhost', 9200, retries=2, retry_delay=0, **kwargs)
+        return indexer
+
+    @gen_test
+    def test_retry_with_same_id(self):
+        client = FailingClient(2)
+        indexer = self.make_indexer(client)
+        yield indexer.index({'name': 'Lilith'})
+        self.assertEqual(len(client.requests), 3)
+        self.assertEqual(len(set(request.url for request in client.requests)), 1)
+
+    @gen_test
+    def test_give_up(self):
+        client = FailingClient(3)
+        indexer = self.make_indexer(client)
+        with self.assertRaises(tornado.httpclient.HTTPError):
+            yield indexer.index({'name': 'Lilith'})
+        self.assertEqual(len(client.requests), 3)
+
+    @gen_test
+    def test_no_retry_with_auto_ids(self):
+        client = FailingClient(1)
+        indexer = self.make_indexer(client, id_strategy='auto')
+        with self.assertRaises(tornado.httpclient.HTTPError):
+            yield indexer.index({'name': 'Lilith'})
+        self.assertEqual(len(client.requests), 1)
+
+    @gen_test
+    def test_compressed_body(self):
+        client = FailingClient(0)
+        indexer = self.make_indexer(client, compression={'encoding': 'gzip', 'min_bytes': 10})
+        self.addCleanup(indexer.compressor.close)
+        doc = {'name': 'Lilith', 'age': 4}
+        yield indexer.index(dict(doc))
+        request = client.requests[0]
+        self.assertEqual(request.headers['Content-Encoding'], 'gzip')
+        self.assertDictEqualWithTimestamp(
+            json.loads(gzip.decompress(request.body).decode('utf-8')), doc)
+
+    @gen_test
+    def test_bulk_write(self):
+        client = FailingClient(1)
+        client.body = b'{"errors": false, "items": []}'
+        indexer = self.make_indexer(client, id_strategy='hash')
+        doc = {'name': 'Lilith', '_index_': 'kita-{name}'}
+        yield indexer.write([(doc, ('app.log', 0, 'line')), ({'name': 'Yuri'}, ('app.log', 5, 'x'))])
+        #retried, as all documents have IDs
+        self.assertEqual(len(client.requests), 2)
+        request = client.requests[-1]
+        self.assertTrue(request.url.endswith('/_bulk'))
+        lines = [json.loads(line) for line in request.body.decode('utf-8').splitlines()]
+        self.assertEqual(len(lines), 4)
+        self.assertEqual(lines[0]['index']['_index'], 'kita-Lilith')
+        self.assertEqual(lines[0]['index']['_id'], content_id('app.log', 0, 'line'))
+        #the document itself is not modified
+        self.assertIn('_index_', doc)
+
+    def bulk_lines(self, request):
+        return [json.loads(line) for line in request.body.decode('utf-8').splitlines()]
+
+    @gen_test
+    def test_bulk_retries_rejected_items(self):
+        client = BulkClient([[201, 429, 400], [429], [201]])
+        indexer = self.make_indexer(client, id_strategy='hash')
+        yield indexer.write([({'n': i}, ('app.log', i, 'line')) for i in range(3)])
+        self.assertEqual(len(client.requests), 3)
+        first, second, third = [self.bulk_lines(request) for request in client.requests]
+        self.assertEqual(len(first), 6)
+        #only the rejected document is sent again, with the same ID
+        self.assertListEqual(second, first[2:4])
+        self.assertListEqual(third, first[2:4])
+
+    @gen_test
+    def test_bulk_gives_up(self):
+        client = BulkClient([[429]] * 3)
+        indexer = self.make_indexer(client, id_strategy='hash')
+        with self.assertLogs('stashpy.indexer', 'WARNING'):
+            yield indexer.write([({'n': 1}, ('app.log', 0, 'line'))])
+        self.assertEqual(len(client.requests), 3)
+
+    @gen_test
+    def test_bulk_no_item_retry_without_ids(self):
+        client = BulkClient([[429]])
+        indexer = self.make_indexer(client, id_strategy='auto')
+        yield indexer.write([({'n': 1}, None)])
+        self.assertEqual(len(client.requests), 1)
+
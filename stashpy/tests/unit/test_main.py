@@ -0,0 +1,165 @@
+import io
+import os
+import gzip
+import json
+import shutil
+import tempfile
+
+from unittest import mock
+
+import yaml
+import tornado.httpclient
+from tornado.testing import AsyncTestCase, gen_test, bind_unused_port
+from tornado.tcpclient import TCPClient
+from tornado import gen
+
+from stashpy.main import App, compile_processor
+from stashpy.processor import LineProcessor
+
+OLD_SPEC = "My name is {name} and I'm {age:d} years old."
+NEW_SPEC = "Her name is {name} and she's {age:d} years old."
+
+
+class TemplateClient:
+    """Records the index templates that are installed"""
+
+    def __init__(self):
+        self.templates = []
+
+    @gen.coroutine
+    def fetch(self, request):
+        self.templates.append(json.loads(request.body))
+        return tornado.httpclient.HTTPResponse(request, 200, buffer=io.BytesIO(b'{}'))
+
+
+class FakeConnection:
+    def __init__(self, line_processor):
+        self.line_processor = line_processor
+
+
+class ReloadTests(AsyncTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.config_path = os.path.join(self.directory, 'config.yml')
+
+    def write_config(self, **config):
+        with open(self.config_path, 'w') as config_file:
+            yaml.safe_dump(config, config_file)
+        return config
+
+    def make_app(self):
+        config = self.write_config(processor_spec={'to_dict': [OLD_SPEC]})
+        app = App(config, config_path=self.config_path)
+        self.addCleanup(app.main.stop)
+        return app
+
+    @gen_test
+    def test_reload(self):
+        app = self.make_app()
+        connection = FakeConnection(app.main.line_processor)
+        app.main.connections.add(connection)
+        self.write_config(processor_spec={'to_dict': [NEW_SPEC]},
+                          validation_lines=["Her name is Lilith and she's 4 years old."])
+        reloaded = yield app.reload()
+        self.assertTrue(reloaded)
+        self.assertIs(connection.line_processor, app.main.line_processor)
+        self.assertDictEqual(
+            connection.line_processor.for_line("Her name is Lilith and she's 4 years old."),
+            {'name': 'Lilith', 'age': 4})
+        self.assertEqual(app.main.processor_spec, {'to_dict': [NEW_SPEC]})
+
+    @gen_test
+    def test_reload_updates_templates_of_outputs(self):
+        client = TemplateClient()
+        config = self.write_config(
+            processor_spec={'to_dict': [OLD_SPEC]},
+            outputs=[{'type': 'elasticsearch', 'host': 'localhost', 'port': 9200,
+                      'index_pattern': 'kita-%Y'},
+                     {'type': 'null'}])
+        with mock.patch('tornado.httpclient.AsyncHTTPClient', return_value=client):
+            app = App(config, config_path=self.config_path)
+        self.addCleanup(app.main.stop)
+        self.write_config(processor_spec={'to_dict': ["{name} weighs {weight:d} kg"]})
+        reloaded = yield app.reload()
+        self.assertTrue(reloaded)
+        yield gen.moment
+        self.assertEqual(len(client.templates), 2)
+        template = client.templates[-1]
+        self.assertEqual(template['template'], 'kita-*')
+        properties = template['mappings']['_default_']['properties']
+        self.assertIn('weight', properties)
+        self.assertNotIn('age', properties)
+        self.assertDictEqual(app.main.indexer.outputs[0].sink.template, template)
+
+    @gen_test
+    def test_invalid_spec(self):
+        app = self.make_app()
+        old_processor = app.main.line_processor
+        self.write_config(processor_spec={'to_dict': ["(?P<broken>[a-z)"]})
+        reloaded = yield app.reload()
+        self.assertFalse(reloaded)
+        self.assertIs(app.main.line_processor, old_processor)
+
+    @gen_test
+    def test_validation_lines(self):
+        app = self.make_app()
+        old_processor = app.main.line_processor
+        self.write_config(processor_spec={'to_dict': [NEW_SPEC]},
+                          validation_lines=["My name is Yuri and I'm 6 years old."])
+        reloaded = yield app.reload()
+        self.assertFalse(reloaded)
+        self.assertIs(app.main.line_processor, old_processor)
+
+    def test_compile_processor(self):
+        self.write_config(processor_spec={'to_dict': [NEW_SPEC]})
+        processor, spec, processor_class = compile_processor(self.config_path)
+        self.assertIsInstance(processor, LineProcessor)
+        self.assertIsNone(processor_class)
+
+
+class ShutdownTests(AsyncTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    @gen_test
+    def test_outputs_closed(self):
+        app = App({'processor_spec': {'to_dict': [OLD_SPEC]},
+                   'outputs': [{'type': 'file', 'directory': self.directory,
+                                'compress': True, 'flush_interval': 60}]})
+        for i in range(10):
+            yield app.main.indexer.index({'number': i})
+        yield app.shutdown()
+        name, = os.listdir(self.directory)
+        with gzip.open(os.path.join(self.directory, name), 'rt') as archive:
+            self.assertListEqual([json.loads(line)['number'] for line in archive],
+                                 list(range(10)))
+
+    def test_elasticsearch_output_without_config(self):
+        with self.assertRaises(ValueError):
+            App({'processor_spec': {'to_dict': [OLD_SPEC]},
+                 'outputs': [{'type': 'elasticsearch'}]})
+
+
+class StartTests(AsyncTestCase):
+
+    @gen_test
+    def test_start_on_running_loop(self):
+        sock, port = bind_unused_port()
+        sock.close()
+        app = App({'processor_spec': {'to_dict': [OLD_SPEC]},
+                   'address': '127.0.0.1', 'port': port,
+                   'outputs': [{'type': 'null', 'flush_interval': 0.01}]})
+        app.start()
+        stream = yield TCPClient().connect('127.0.0.1', port)
+        yield stream.write(b"My name is Yuri and I'm 6 years old.\n")
+        stream.close()
+        while app.main.indexer.sink.written < 1:
+            yield gen.sleep(0.01)
+        yield app.shutdown()
+        self.assertEqual(app.main.indexer.sink.written, 1)
@@ -0,0 +1,66 @@
+import unittest
+
+from stashpy.multiline import MultilineSpec
+
+PYTHON_TRACE = [
+    "2016-03-25 12:26:57 ERROR Something went wrong",
+    "Traceback (most recent call last):",
+    '  File "app.py", line 3, in <module>',
+    "    main()",
+    "ValueError: invalid literal",
+]
+
+JAVA_TRACE = [
+    "2016-03-25 12:26:57 ERROR Request failed",
+    "java.lang.IllegalStateException: boom",
+    "\tat com.example.App.run(App.java:10)",
+    "Caused by: java.lang.NullPointerException",
+    "\t... 5 more",
+]
+
+
+class MultilineAggregatorTests(unittest.TestCase):
+
+    def feed_all(self, aggregator, lines):
+        events = []
+        for line in lines:
+            events.extend(aggregator.feed(line))
+        return events
+
+    def test_python_trace(self):
+        aggregator = MultilineSpec().aggregator()
+        events = self.feed_all(aggregator, PYTHON_TRACE + ["Next line"])
+        self.assertListEqual(events, [("\n".join(PYTHON_TRACE), False)])
+        self.assertEqual(aggregator.flush(), ("Next line", False))
+        self.assertIsNone(aggregator.flush())
+
+    def test_java_trace(self):
+        aggregator = MultilineSpec().aggregator()
+        events = self.feed_all(aggregator, JAVA_TRACE + ["Next line"])
+        self.assertListEqual(events, [("\n".join(JAVA_TRACE), False)])
+
+    def test_single_lines(self):
+        aggregator = MultilineSpec().aggregator()
+        self.assertListEqual(self.feed_all(aggregator, ["one", "two", "three"]),
+                             [("one", False), ("two", False)])
+
+    def test_start_pattern(self):
+        aggregator = MultilineSpec({'start': r'^\d{4}-'}).aggregator()
+        events = self.feed_all(aggregator, ["2016-01-01 first", "more", "2016-01-02 second"])
+        self.assertListEqual(events, [("2016-01-01 first\nmore", False)])
+
+    def test_max_lines(self):
+        aggregator = MultilineSpec({'max_lines': 2}).aggregator()
+        self.feed_all(aggregator, PYTHON_TRACE)
+        self.assertEqual(aggregator.flush(), ("\n".join(PYTHON_TRACE[:2]), True))
+
+    def test_max_bytes(self):
+        aggregator = MultilineSpec({'max_bytes': 20}).aggregator()
+        self.feed_all(aggregator, ["first line", "  second", "  third is too long"])
+        self.assertEqual(aggregator.flush(), ("first line\n  second", True))
+
+    def test_max_bytes_counts_encoded_bytes(self):
+        aggregator = MultilineSpec({'max_bytes': 20}).aggregator()
+        #19 characters, but 25 bytes in UTF-8
+        self.feed_all(aggregator, ["first line", "  äöüäöü"])
+        self.assertEqual(aggregator.flush(), ("first line", True))
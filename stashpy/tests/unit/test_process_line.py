@@ -1,11 +1,14 @@
 import unittest
+import socket
 from tornado.testing import AsyncTestCase, gen_test
 from tornado import gen
+from tornado.iostream import IOStream
 
 import stashpy.handler
 from stashpy.processor import LineProcessor, FormatSpec
 from stashpy.pattern_matching import is_named_re, LineParser
-from .common import TimeStampedMixin
+from stashpy.multiline import MultilineSpec
+from .common import TimeStampedMixin, RecordingIndexer
 
 SAMPLE_PARSE = "My name is {name} and I'm {age:d} years old."
 SAMPLE_REGEXP = "My name is (?P<name>\w*) and I'm (?P<age>\d*) years old\."
@@ -82,13 +85,9 @@ class LineProcessorTests(unittest.TestCase):
 class MockStream:
     def set_close_callback(*args, **kwargs): pass
 
-class MockIndexer:
-    @gen.coroutine
-    def index(self, doc):
-        if not hasattr(self, 'indexed'):
-            self.indexed = []
-        self.indexed.append(doc)
-        return doc
+class FailingIndexer:
+    def index(self, doc, key=None):
+        raise RuntimeError("Indexing failed")
 
 class ConnectionHandlerTests(AsyncTestCase, TimeStampedMixin):
 
@@ -96,7 +95,7 @@ class ConnectionHandlerTests(AsyncTestCase, TimeStampedMixin):
     def test_no_parse(self):
         SPEC = {'to_dict':[SAMPLE_PARSE]}
         processor = LineProcessor(SPEC)
-        indexer = MockIndexer()
+        indexer = RecordingIndexer()
         handler = stashpy.handler.ConnectionHandler(MockStream(), None, indexer, processor)
         resp = yield handler.process_line(b"A random line")
         self.assertEqual(len(indexer.indexed), 1)
@@ -104,6 +103,136 @@ class ConnectionHandlerTests(AsyncTestCase, TimeStampedMixin):
             indexer.indexed[0],
             {'message': 'A random line', '@version': 1})
 
+    @gen_test
+    def test_invalid_utf8(self):
+        indexer = RecordingIndexer()
+        server_sock, client_sock = socket.socketpair()
+        self.addCleanup(client_sock.close)
+        handler = stashpy.handler.ConnectionHandler(IOStream(server_sock), None,
+                                                    indexer, LineProcessor())
+        client_sock.sendall(b"caf\xe9\nnext\n")
+        client_sock.shutdown(socket.SHUT_WR)
+        yield handler.on_connect()
+        self.assertListEqual([doc['message'] for doc in indexer.indexed],
+                             ['caf\ufffd', 'next'])
+
+    @gen_test
+    def test_stream_closed_on_error(self):
+        server_sock, client_sock = socket.socketpair()
+        self.addCleanup(client_sock.close)
+        stream = IOStream(server_sock)
+        handler = stashpy.handler.ConnectionHandler(stream, None, FailingIndexer(),
+                                                    LineProcessor())
+        client_sock.sendall(b"a line\n")
+        with self.assertRaises(RuntimeError):
+            yield handler.on_connect()
+        self.assertTrue(stream.closed())
+
+    @gen_test
+    def test_keys_differ_between_connections(self):
+        processor = LineProcessor({'to_dict':[SAMPLE_PARSE]})
+        indexer = RecordingIndexer()
+        for _ in range(2):
+            handler = stashpy.handler.ConnectionHandler(MockStream(), None, indexer, processor)
+            yield handler.process_line(b"A random line")
+        keys = indexer.keys
+        self.assertEqual(keys[0][1:], keys[1][1:])
+        self.assertNotEqual(keys[0], keys[1])
+
+    @gen_test
+    def test_truncated(self):
+        SPEC = {'to_dict':[SAMPLE_PARSE]}
+        processor = LineProcessor(SPEC)
+        indexer = RecordingIndexer()
+        handler = stashpy.handler.ConnectionHandler(MockStream(), None, indexer, processor)
+        resp = yield handler.process_line(b"A random \xc3", truncated=True)
+        self.assertDictEqualWithTimestamp(
+            indexer.indexed[0],
+            {'message': 'A random \ufffd', '@version': 1, 'truncated': True})
+
+    @gen_test
+    def test_idle_timeout(self):
+        processor = LineProcessor({'to_dict':[SAMPLE_PARSE]})
+        indexer = RecordingIndexer()
+        server_sock, client_sock = socket.socketpair()
+        self.addCleanup(client_sock.close)
+        handler = stashpy.handler.ConnectionHandler(IOStream(server_sock), None,
+                                                    indexer, processor,
+                                                    idle_timeout=0.1)
+        client_sock.sendall(b"A random line\n")
+        yield handler.on_connect()
+        self.assertEqual(len(indexer.indexed), 1)
+        self.assertIsNone(handler.stream)
+        self.assertIsNone(handler.framer)
+
+    @gen_test
+    def test_octet_counted(self):
+        processor = LineProcessor({'to_dict':[SAMPLE_PARSE]})
+        indexer = RecordingIndexer()
+        server_sock, client_sock = socket.socketpair()
+        handler = stashpy.handler.ConnectionHandler(IOStream(server_sock), None,
+                                                    indexer, processor,
+                                                    max_line_bytes=12,
+                                                    framing='octet_counted')
+        client_sock.sendall(b"12 first\nsecond16 a very long line3 end")
+        client_sock.close()
+        yield handler.on_connect()
+        self.assertListEqual([(doc['message'], doc.get('truncated', False))
+                              for doc in indexer.indexed],
+                             [('first\nsecond', False), ('a very long ', True),
+                              ('end', False)])
+
+    @gen_test
+    def test_invalid_frame_length(self):
+        for data in [b"3 one-5 two", b"3 one0 two", b"3 one12345678901234 two", b"3 onex two"]:
+            indexer = RecordingIndexer()
+            server_sock, client_sock = socket.socketpair()
+            self.addCleanup(client_sock.close)
+            handler = stashpy.handler.ConnectionHandler(IOStream(server_sock), None,
+                                                        indexer, LineProcessor(),
+                                                        framing='octet_counted')
+            client_sock.sendall(data)
+            yield handler.on_connect()
+            self.assertListEqual([doc['message'] for doc in indexer.indexed], ['one'])
+            self.assertIsNone(handler.stream)
+
+    @gen_test
+    def test_multiline(self):
+        processor = LineProcessor({'to_dict':[SAMPLE_PARSE]})
+        indexer = RecordingIndexer()
+        server_sock, client_sock = socket.socketpair()
+        self.addCleanup(client_sock.close)
+        handler = stashpy.handler.ConnectionHandler(
+            IOStream(server_sock), None, indexer, processor,
+            multiline=MultilineSpec({'flush_timeout': 0.05}))
+        client_sock.sendall(b"Error\nTraceback (most recent call last):\n  File x\nNext\n")
+        connected = gen.convert_yielded(handler.on_connect())
+        yield gen.sleep(0.1)
+        self.assertListEqual([doc['message'] for doc in indexer.indexed],
+                             ["Error\nTraceback (most recent call last):\n  File x", "Next"])
+        client_sock.sendall(b"Last\n")
+        client_sock.shutdown(socket.SHUT_WR)
+        yield connected
+        self.assertEqual(indexer.indexed[-1]['message'], "Last")
+
+    @gen_test
+    def test_multiline_parsed_by_first_line(self):
+        processor = LineProcessor({'to_dict':[SAMPLE_PARSE]})
+        indexer = RecordingIndexer()
+        server_sock, client_sock = socket.socketpair()
+        self.addCleanup(client_sock.close)
+        handler = stashpy.handler.ConnectionHandler(
+            IOStream(server_sock), None, indexer, processor, multiline=MultilineSpec())
+        client_sock.sendall(b"My name is Yuri and I'm 6 years old.\n"
+                            b"Traceback (most recent call last):\n  File x\n")
+        client_sock.shutdown(socket.SHUT_WR)
+        yield handler.on_connect()
+        doc, = indexer.indexed
+        self.assertEqual(doc['name'], 'Yuri')
+        self.assertEqual(doc['age'], 6)
+        self.assertEqual(doc['message'], "My name is Yuri and I'm 6 years old.\n"
+                         "Traceback (most recent call last):\n  File x")
+
 
 class KitaHandler(LineProcessor):
 
@@ -153,3 +282,20 @@ class MainHandlerTests(unittest.TestCase):
             processor_class='stashpy.tests.unit.test_process_line.KitaHandler'))
         processor = main.load_processor()
         self.assertDictEqual(processor.for_line("blah"), dict(val='test'))
+
+    def test_memory_report(self):
+        main = stashpy.handler.MainHandler(dict(
+            processor_spec={'to_dict': [SAMPLE_PARSE]}))
+        for partial in [b"My name", b"My name is"]:
+            stream = MockStream()
+            stream._read_buffer_size = 0
+            cn = stashpy.handler.ConnectionHandler(stream, None, main.indexer,
+                                                   main.line_processor, budget=main.budget)
+            cn.framer.feed(partial)
+            main.connections.add(cn)
+        per_connection, total = main.memory_report()
+        self.assertListEqual(sorted(per_connection.values()), [7, 10])
+        self.assertEqual(total, 17)
+        with self.assertLogs('stashpy.handler') as logs:
+            main.log_memory_report()
+        self.assertEqual(len(logs.output), 3)
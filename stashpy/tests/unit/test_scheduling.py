@@ -0,0 +1,59 @@
+import unittest
+
+from stashpy.scheduling import TokenBucket, ClientQuota, Scheduler
+
+
+class TokenBucketTests(unittest.TestCase):
+
+    def test_burst(self):
+        bucket = TokenBucket(10, burst=3)
+        self.assertListEqual([bucket.consume(0) for _ in range(3)], [0, 0, 0])
+        self.assertAlmostEqual(bucket.consume(0), 0.1)
+
+    def test_refill(self):
+        bucket = TokenBucket(10, burst=1)
+        self.assertEqual(bucket.consume(0), 0)
+        self.assertEqual(bucket.consume(0.1), 0)
+        self.assertEqual(bucket.consume(10), 0)
+        self.assertEqual(bucket.tokens, 0)
+
+
+class ClientQuotaTests(unittest.TestCase):
+
+    def test_yield_after_quantum(self):
+        quota = ClientQuota(3)
+        self.assertListEqual([quota.charge(0) for _ in range(4)],
+                             [None, None, 0, None])
+
+    def test_rate_limit(self):
+        quota = ClientQuota(100, TokenBucket(2, burst=1))
+        self.assertIsNone(quota.charge(0))
+        self.assertAlmostEqual(quota.charge(0), 0.5)
+
+
+class SchedulerTests(unittest.TestCase):
+
+    CONFIG = {'quantum': 10,
+              'classes': [{'name': 'noisy', 'networks': ['10.1.0.0/16'],
+                           'weight': 0.5, 'rate': 100},
+                          {'name': 'important', 'networks': ['10.2.0.5'],
+                           'weight': 4}]}
+
+    def test_class_by_cidr(self):
+        scheduler = Scheduler(self.CONFIG)
+        self.assertEqual(scheduler.class_for(('10.1.3.4', 5000)).name, 'noisy')
+        self.assertEqual(scheduler.class_for(('10.2.0.5', 5000)).name, 'important')
+        self.assertEqual(scheduler.class_for(('10.2.0.6', 5000)).name, 'default')
+
+    def test_quota(self):
+        scheduler = Scheduler(self.CONFIG)
+        noisy = scheduler.quota_for(('10.1.3.4', 5000))
+        self.assertEqual(noisy.quantum, 5)
+        self.assertEqual(noisy.bucket.rate, 100)
+        important = scheduler.quota_for(('10.2.0.5', 5000))
+        self.assertEqual(important.quantum, 40)
+        self.assertIsNone(important.bucket)
+
+    def test_no_address(self):
+        scheduler = Scheduler()
+        self.assertEqual(scheduler.class_for(None).name, 'default')
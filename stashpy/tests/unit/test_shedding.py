@@ -0,0 +1,118 @@
+import unittest
+
+from tornado.testing import AsyncTestCase, gen_test
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.queues import Queue
+
+from stashpy.processor import LineProcessor, LowPriority, make_document
+from stashpy.shedding import LoadShedder, Sampler
+
+SPECS = {'to_dict': ["My name is {name} and I'm {age:d} years old.",
+                     "debug: {what}"],
+         'low_priority': ["debug: {what}"]}
+
+
+class LowPriorityTests(unittest.TestCase):
+
+    def test_marked(self):
+        processor = LineProcessor(SPECS)
+        doc, parsed = make_document(processor, "debug: cache miss")
+        self.assertTrue(parsed)
+        self.assertIsInstance(doc, LowPriority)
+        self.assertEqual(doc['what'], 'cache miss')
+        doc, _ = make_document(processor, "My name is Yuri and I'm 6 years old.")
+        self.assertNotIsInstance(doc, LowPriority)
+
+    def test_format_spec(self):
+        processor = LineProcessor({'to_format': {"debug: {what}": {'detail': '{what}'}},
+                                   'low_priority': ["debug: {what}"]})
+        self.assertIsInstance(processor.for_line("debug: x"), LowPriority)
+
+
+class SamplerTests(unittest.TestCase):
+
+    def test_rate(self):
+        sampler = Sampler(0.25)
+        kept = [sampler.keep() for _ in range(8)]
+        self.assertListEqual(kept, [False, False, False, True] * 2)
+
+
+class LoadShedderTests(AsyncTestCase):
+
+    def make_shedder(self, **config):
+        config.setdefault('max_pending', 10)
+        config.setdefault('unparsed_sample', 0.5)
+        config.setdefault('low_priority_sample', 0.5)
+        return LoadShedder(config, io_loop=self.io_loop)
+
+    def admitted(self, shedder, doc, parsed, count=10):
+        return sum(shedder.admit(doc, parsed) for _ in range(count))
+
+    def test_normal(self):
+        shedder = self.make_shedder()
+        self.assertEqual(self.admitted(shedder, {}, False), 10)
+
+    def test_overloaded(self):
+        shedder = self.make_shedder()
+        shedder.pending = 10
+        self.assertEqual(self.admitted(shedder, {}, False), 5)
+        self.assertEqual(self.admitted(shedder, LowPriority(), True), 10)
+        self.assertEqual(self.admitted(shedder, {}, True), 10)
+        self.assertEqual(shedder.stats()['dropped_unparsed'], 5)
+
+    def test_severe(self):
+        shedder = self.make_shedder()
+        shedder.pending = 20
+        self.assertEqual(self.admitted(shedder, {}, False), 0)
+        self.assertEqual(self.admitted(shedder, LowPriority(), True), 5)
+        self.assertEqual(self.admitted(shedder, {}, True), 10)
+        self.assertEqual(shedder.dropped_unparsed, 10)
+        self.assertEqual(shedder.dropped_low_priority, 5)
+
+    def test_latency(self):
+        shedder = self.make_shedder(max_latency=0.5)
+        shedder.latency = 1.5
+        self.assertEqual(self.admitted(shedder, {}, False), 0)
+
+    def test_default_max_latency(self):
+        shedder = self.make_shedder()
+        shedder.latency = 1.5
+        self.assertEqual(self.admitted(shedder, {}, False), 5)
+
+    def test_recovers_when_all_lines_are_shed(self):
+        shedder = self.make_shedder(latency_half_life=1)
+        shedder.latency = 2.5
+        self.assertEqual(self.admitted(shedder, {}, False, count=20), 0)
+        #nothing was tracked, but the latency decays over time
+        shedder.last_completion -= 3
+        self.assertEqual(self.admitted(shedder, {}, False, count=20), 20)
+        self.assertEqual(shedder.stats()['level'], 'normal')
+
+    def test_no_decay_while_pending(self):
+        shedder = self.make_shedder(latency_half_life=1)
+        shedder.latency = 2.5
+        shedder.pending = 1
+        shedder.last_completion -= 3
+        self.assertEqual(self.admitted(shedder, {}, False), 0)
+
+    def test_queue(self):
+        shedder = self.make_shedder()
+        queue = Queue(maxsize=4)
+        shedder.watch(queue)
+        self.assertEqual(self.admitted(shedder, {}, False), 10)
+        for i in range(4):
+            queue.put_nowait(i)
+        self.assertEqual(self.admitted(shedder, {}, False), 0)
+
+    @gen_test
+    def test_track(self):
+        shedder = self.make_shedder()
+        future = Future()
+        tracked = gen.convert_yielded(shedder.track(future))
+        yield gen.moment
+        self.assertEqual(shedder.pending, 1)
+        future.set_result('done')
+        result = yield tracked
+        self.assertEqual(result, 'done')
+        self.assertEqual(shedder.pending, 0)
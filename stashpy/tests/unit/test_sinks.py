@@ -0,0 +1,134 @@
+import os
+import gzip
+import json
+import shutil
+import tempfile
+
+from tornado.testing import AsyncTestCase, gen_test
+from tornado import gen
+
+from stashpy.sinks import (BufferedOutput, FanOut, NDJSONFileSink, NullSink,
+                           load_outputs)
+
+
+class RecordingSink:
+
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.batches = []
+        self.flushes = 0
+        self.closed = False
+
+    @gen.coroutine
+    def write(self, items):
+        if self.delay:
+            yield gen.sleep(self.delay)
+        self.batches.append([doc for doc, _ in items])
+
+    @gen.coroutine
+    def flush(self):
+        self.flushes += 1
+
+    def close(self):
+        self.closed = True
+
+
+class BufferedOutputTests(AsyncTestCase):
+
+    @gen_test
+    def test_batches(self):
+        sink = RecordingSink()
+        output = BufferedOutput(sink, {'batch_size': 3}, io_loop=self.io_loop)
+        yield gen.multi([output.index({'number': i}) for i in range(7)])
+        yield output.close()
+        self.assertListEqual([len(batch) for batch in sink.batches], [3, 3, 1])
+        self.assertEqual(sink.batches[-1][0]['number'], 6)
+        self.assertTrue(sink.closed)
+
+    @gen_test
+    def test_flush_interval(self):
+        sink = RecordingSink()
+        output = BufferedOutput(sink, {'flush_interval': 0.01}, io_loop=self.io_loop)
+        yield gen.sleep(0.05)
+        self.assertGreater(sink.flushes, 1)
+        yield output.close()
+
+    @gen_test
+    def test_slow_sink_does_not_block(self):
+        slow, fast = RecordingSink(delay=0.5), RecordingSink()
+        fan_out = FanOut([
+            BufferedOutput(slow, {'queue_size': 2, 'batch_size': 1, 'when_full': 'drop'},
+                           io_loop=self.io_loop),
+            BufferedOutput(fast, io_loop=self.io_loop)])
+        for i in range(10):
+            yield fan_out.index({'number': i})
+        yield gen.sleep(0.01)
+        self.assertEqual(sum(len(batch) for batch in fast.batches), 10)
+        self.assertEqual(fan_out.outputs[0].dropped, 7)
+
+
+class NDJSONFileSinkTests(AsyncTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def read_all(self, opener=open):
+        docs = []
+        for name in sorted(os.listdir(self.directory)):
+            with opener(os.path.join(self.directory, name), 'rb') as infile:
+                docs.extend(json.loads(line.decode('utf-8')) for line in infile)
+        return docs
+
+    @gen_test
+    def test_buffering(self):
+        sink = NDJSONFileSink({'directory': self.directory, 'buffer_bytes': 1000})
+        yield sink.write([({'number': 1, '_index_': 'x'}, None)])
+        self.assertEqual(os.listdir(self.directory), [])
+        yield sink.flush()
+        sink.close()
+        self.assertListEqual(self.read_all(), [{'number': 1}])
+
+    @gen_test
+    def test_rotation(self):
+        sink = NDJSONFileSink({'directory': self.directory, 'buffer_bytes': 1,
+                               'rotate_bytes': 30})
+        for i in range(6):
+            yield sink.write([({'number': i}, None)])
+        sink.close()
+        #each line is 14 bytes, so a new file is started after three lines
+        self.assertEqual(len(os.listdir(self.directory)), 2)
+        self.assertListEqual([doc['number'] for doc in self.read_all()], list(range(6)))
+
+    @gen_test
+    def test_compressed(self):
+        sink = NDJSONFileSink({'directory': self.directory, 'compress': True})
+        yield sink.write([({'number': i}, None) for i in range(100)])
+        sink.close()
+        names = os.listdir(self.directory)
+        self.assertTrue(names[0].endswith('.ndjson.gz'))
+        self.assertEqual(len(self.read_all(gzip.open)), 100)
+
+
+class LoadOutputsTests(AsyncTestCase):
+
+    def test_load(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        es_configs = []
+        outputs = load_outputs([{'type': 'null'},
+                                {'type': 'file', 'directory': directory, 'queue_size': 5},
+                                {'type': 'elasticsearch', 'batch_size': 100}],
+                               es_sink=lambda config: es_configs.append(config) or NullSink(),
+                               io_loop=self.io_loop)
+        self.assertIsInstance(outputs, FanOut)
+        self.assertIsInstance(outputs.outputs[1].sink, NDJSONFileSink)
+        self.assertEqual(outputs.outputs[1].queue.maxsize, 5)
+        self.assertEqual(outputs.outputs[2].batch_size, 100)
+        self.assertListEqual(es_configs, [{}])
+        outputs.outputs[1].sink.close()
+
+    def test_unknown_type(self):
+        with self.assertRaises(ValueError):
+            load_outputs([{'type': 'kafka'}], io_loop=self.io_loop)
@@ -0,0 +1,75 @@
+import unittest
+
+from stashpy.structured import decode_json, decode_kv
+from stashpy.processor import LineProcessor
+
+SAMPLE_PARSE = "My name is {name} and I'm {age:d} years old."
+
+
+class DecodeJSONTests(unittest.TestCase):
+
+    def test_object(self):
+        self.assertDictEqual(decode_json(' {"name": "Yuri", "age": 6} '),
+                             {'name': 'Yuri', 'age': 6})
+
+    def test_not_json(self):
+        self.assertIsNone(decode_json("My name is Yuri"))
+        self.assertIsNone(decode_json("{not json}"))
+        self.assertIsNone(decode_json('["a", "list"]'))
+
+    def test_reserved_fields(self):
+        self.assertDictEqual(decode_json('{"_index_": "other-tenant", "_id": 1, "name": "Yuri"}'),
+                             {'name': 'Yuri'})
+
+
+class DecodeKVTests(unittest.TestCase):
+
+    def test_pairs(self):
+        self.assertDictEqual(
+            decode_kv('level=info msg="request \\"done\\"" path=/orders status=200 empty='),
+            {'level': 'info', 'msg': 'request "done"', 'path': '/orders',
+             'status': '200', 'empty': ''})
+
+    def test_dotted_keys(self):
+        self.assertDictEqual(decode_kv('http.method=GET user-id=4'),
+                             {'http.method': 'GET', 'user-id': '4'})
+
+    def test_not_kv(self):
+        self.assertIsNone(decode_kv("My name is Yuri and x=3"))
+        self.assertIsNone(decode_kv("a=1 and b=2"))
+        self.assertIsNone(decode_kv('msg="unterminated'))
+        self.assertIsNone(decode_kv('msg="quoted"trailing'))
+        self.assertIsNone(decode_kv("=value"))
+
+    def test_reserved_fields(self):
+        self.assertDictEqual(decode_kv('_index_=other-tenant name=Yuri _id=1'),
+                             {'name': 'Yuri'})
+
+
+class StructuredProcessorTests(unittest.TestCase):
+
+    def test_structured_first(self):
+        processor = LineProcessor({'structured': ['json', 'kv'],
+                                   'to_dict': [SAMPLE_PARSE]})
+        self.assertDictEqual(processor.for_line('{"name": "Yuri"}'), {'name': 'Yuri'})
+        self.assertDictEqual(processor.for_line('name=Yuri age=6'),
+                             {'name': 'Yuri', 'age': '6'})
+        self.assertDictEqual(processor.for_line("My name is Yuri and I'm 6 years old."),
+                             {'name': 'Yuri', 'age': 6})
+
+    def test_reserved_fields_do_not_choose_index(self):
+        from stashpy.indexer import index_name
+        processor = LineProcessor({'structured': ['json', 'kv']})
+        for line in ['{"_index_": "{nope}", "name": "Yuri"}', '_index_=x name=Yuri']:
+            doc = processor.for_line(line)
+            self.assertDictEqual(doc, {'name': 'Yuri'})
+            self.assertEqual(index_name(doc, 'stashpy'), 'stashpy')
+
+    def test_not_enabled(self):
+        processor = LineProcessor({'to_dict': [SAMPLE_PARSE]})
+        self.assertIsNone(processor.for_line('{"name": "Yuri"}'))
+
+    def test_class_attribute(self):
+        class JSONProcessor(LineProcessor):
+            STRUCTURED = ['json']
+        self.assertDictEqual(JSONProcessor().for_line('{"a": 1}'), {'a': 1})
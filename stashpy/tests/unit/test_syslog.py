@@ -0,0 +1,94 @@
+import unittest
+from datetime import datetime
+
+from stashpy.syslog import parse_syslog_header
+from stashpy.processor import LineProcessor, make_document
+
+
+class RFC5424Tests(unittest.TestCase):
+
+    def test_full_header(self):
+        line = ('<165>1 2003-10-11T22:14:15.003Z mymachine.example.com evntslog '
+                '- ID47 [exampleSDID@32473 iut="3" eventSource="Application"] '
+                'An application event log entry')
+        fields, body = parse_syslog_header(line)
+        self.assertDictEqual(fields,
+                             {'severity': 'notice', 'facility': 'local4',
+                              '@timestamp': '2003-10-11T22:14:15.003Z',
+                              'host': 'mymachine.example.com', 'app': 'evntslog',
+                              'msgid': 'ID47',
+                              'structured_data': '[exampleSDID@32473 iut="3" eventSource="Application"]'})
+        self.assertEqual(body, 'An application event log entry')
+
+    def test_escaped_structured_data(self):
+        line = '<34>1 - host app 12 - [id a="x\\]y"][id2 b="z"] \ufeffThe message'
+        fields, body = parse_syslog_header(line)
+        self.assertEqual(fields['structured_data'], '[id a="x\\]y"][id2 b="z"]')
+        self.assertEqual(fields['procid'], '12')
+        self.assertNotIn('@timestamp', fields)
+        self.assertEqual(body, 'The message')
+
+    def test_nil_structured_data(self):
+        fields, body = parse_syslog_header('<14>1 - - - - - - Hello')
+        self.assertDictEqual(fields, {'severity': 'info', 'facility': 'user'})
+        self.assertEqual(body, 'Hello')
+
+
+class RFC3164Tests(unittest.TestCase):
+
+    NOW = datetime(2016, 3, 25, 12, 0, 0)
+
+    def test_header(self):
+        fields, body = parse_syslog_header(
+            '<13>Mar 25 12:26:57 myserver.io nginx[1234]: GET /orders', now=self.NOW)
+        self.assertDictEqual(fields,
+                             {'severity': 'notice', 'facility': 'user',
+                              '@timestamp': '2016-03-25T12:26:57',
+                              'host': 'myserver.io', 'app': 'nginx', 'procid': '1234'})
+        self.assertEqual(body, 'GET /orders')
+
+    def test_padded_day_no_tag(self):
+        fields, body = parse_syslog_header('<13>Mar  5 12:26:57 myserver.io just a message',
+                                           now=self.NOW)
+        self.assertEqual(fields['@timestamp'], '2016-03-05T12:26:57')
+        self.assertNotIn('app', fields)
+        self.assertEqual(body, 'just a message')
+
+    def test_previous_year(self):
+        fields, _ = parse_syslog_header('<13>Dec 31 23:59:59 host app: message',
+                                        now=datetime(2017, 1, 1))
+        self.assertEqual(fields['@timestamp'], '2016-12-31T23:59:59')
+
+    def test_leap_day(self):
+        fields, _ = parse_syslog_header('<34>Feb 29 12:00:00 host app: message',
+                                        now=datetime(2016, 3, 1))
+        self.assertEqual(fields['@timestamp'], '2016-02-29T12:00:00')
+
+    def test_impossible_date(self):
+        for line in ['<34>Feb 29 12:00:00 host app: message',
+                     '<34>Feb 30 12:00:00 host app: message',
+                     '<34>Feb 28 25:00:00 host app: message']:
+            fields, body = parse_syslog_header(line, now=datetime(2026, 3, 1))
+            self.assertNotIn('@timestamp', fields)
+            self.assertEqual(fields['host'], 'host')
+            self.assertEqual(body, 'message')
+
+    def test_no_header(self):
+        self.assertIsNone(parse_syslog_header("My name is Yuri"))
+        self.assertIsNone(parse_syslog_header("<13>garbage"))
+
+
+class MakeDocumentTests(unittest.TestCase):
+
+    def test_specs_on_body(self):
+        processor = LineProcessor({'to_dict': ["My name is {name} and I'm {age:d} years old."]})
+        doc, parsed = make_document(
+            processor,
+            "<13>1 2016-03-25T12:26:57Z kita app - - - My name is Yuri and I'm 6 years old.",
+            syslog_header=True)
+        self.assertTrue(parsed)
+        self.assertDictEqual(doc, {'name': 'Yuri', 'age': 6, '@version': 1,
+                                   'message': "My name is Yuri and I'm 6 years old.",
+                                   'severity': 'notice', 'facility': 'user',
+                                   '@timestamp': '2016-03-25T12:26:57Z',
+                                   'host': 'kita', 'app': 'app'})
@@ -0,0 +1,75 @@
+import unittest
+from unittest import mock
+from datetime import datetime
+
+from stashpy.timestamps import TimestampParser, TimestampStage
+from stashpy.processor import LineProcessor, make_document
+
+
+class TimestampParserTests(unittest.TestCase):
+
+    def test_auto_formats(self):
+        parser = TimestampParser()
+        self.assertEqual(parser('25/Mar/2016:12:26:57 +0200'), '2016-03-25T12:26:57+02:00')
+        self.assertEqual(parser('2016-03-25T12:26:57Z'), '2016-03-25T12:26:57+00:00')
+        self.assertEqual(parser('2016-03-25 12:26:57'), '2016-03-25T12:26:57+00:00')
+        self.assertEqual(parser('1458908817'), '2016-03-25T12:26:57+00:00')
+
+    def test_no_year(self):
+        parser = TimestampParser()
+        self.assertEqual(parser('Mar  5 12:26:57'),
+                         '{}-03-05T12:26:57+00:00'.format(datetime.utcnow().year))
+
+    def test_leap_day_without_year(self):
+        with mock.patch('stashpy.timestamps._current_year', return_value=2016):
+            self.assertEqual(TimestampParser()('Feb 29 12:00:00'), '2016-02-29T12:00:00+00:00')
+        with mock.patch('stashpy.timestamps._current_year', return_value=2017):
+            self.assertIsNone(TimestampParser()('Feb 29 12:00:00'))
+
+    def test_fraction(self):
+        parser = TimestampParser()
+        self.assertEqual(parser('2016-03-25 12:26:57,123'), '2016-03-25T12:26:57.123000+00:00')
+        self.assertEqual(parser('2016-03-25T12:26:57.1234567+01:00'),
+                         '2016-03-25T12:26:57.123456+01:00')
+        self.assertEqual(parser('1458908817.5'), '2016-03-25T12:26:57.500000+00:00')
+
+    def test_cache_by_second(self):
+        parser = TimestampParser()
+        parser('2016-03-25 12:26:57.100')
+        parser('2016-03-25 12:26:57.200')
+        parser('2016-03-25 12:26:58.100')
+        self.assertListEqual(sorted(parser.cache),
+                             ['2016-03-25 12:26:57', '2016-03-25 12:26:58'])
+
+    def test_remembers_format(self):
+        parser = TimestampParser(['%d.%m.%Y %H:%M:%S', '%Y/%m/%d %H:%M:%S'])
+        parser('2016/03/25 12:26:57')
+        self.assertEqual(parser.current, '%Y/%m/%d %H:%M:%S')
+        self.assertEqual(parser('25.03.2016 12:26:57'), '2016-03-25T12:26:57+00:00')
+        self.assertEqual(parser.current, '%d.%m.%Y %H:%M:%S')
+
+    def test_configured_fraction_format(self):
+        parser = TimestampParser(['%Y%m%d %H:%M:%S.%f'])
+        self.assertEqual(parser('20160325 12:26:57.25'), '2016-03-25T12:26:57.250000+00:00')
+
+    def test_unparseable(self):
+        self.assertIsNone(TimestampParser()('not a timestamp'))
+
+
+class TimestampStageTests(unittest.TestCase):
+
+    def test_stage(self):
+        stage = TimestampStage({'fields': ['time_local', 'timestamp'], 'remove_field': True})
+        doc = stage({'timestamp': '2016-03-25 12:26:57', 'other': 1})
+        self.assertDictEqual(doc, {'@timestamp': '2016-03-25T12:26:57+00:00', 'other': 1})
+
+    def test_failure_keeps_field(self):
+        stage = TimestampStage({'field': 'timestamp'})
+        self.assertDictEqual(stage({'timestamp': 'garbage'}), {'timestamp': 'garbage'})
+        self.assertEqual(stage.failed, 1)
+
+    def test_make_document(self):
+        processor = LineProcessor({'to_dict': ["[{timestamp}] {message}"]})
+        doc, _ = make_document(processor, "[25/Mar/2016:12:26:57 +0000] hello",
+                               stages=[TimestampStage({'field': 'timestamp'})])
+        self.assertEqual(doc['@timestamp'], '2016-03-25T12:26:57+00:00')
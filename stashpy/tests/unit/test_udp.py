@@ -0,0 +1,77 @@
+import socket
+
+from tornado.testing import AsyncTestCase, gen_test
+from tornado import gen
+
+from stashpy.processor import LineProcessor
+from stashpy.udp import UDPListener, kernel_drops
+from .common import TimeStampedMixin, RecordingIndexer
+
+SAMPLE_PARSE = "My name is {name} and I'm {age:d} years old."
+
+
+class UDPListenerTests(AsyncTestCase, TimeStampedMixin):
+
+    def setUp(self):
+        super().setUp()
+        self.listeners = []
+
+    def tearDown(self):
+        #the IOLoop closes all its file descriptors on tear down
+        for listener in self.listeners:
+            listener.stop()
+        super().tearDown()
+
+    def make_listener(self, **config):
+        config.setdefault('address', '127.0.0.1')
+        config.setdefault('port', 0)
+        indexer = RecordingIndexer()
+        listener = UDPListener(config, indexer,
+                               LineProcessor({'to_dict': [SAMPLE_PARSE]}),
+                               io_loop=self.io_loop)
+        listener.listen()
+        self.listeners.append(listener)
+        return listener, indexer
+
+    def send(self, listener, *datagrams):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.addCleanup(sock.close)
+        for datagram in datagrams:
+            sock.sendto(datagram, listener.socket.getsockname())
+
+    def test_drain_batch(self):
+        listener, _ = self.make_listener(batch_size=2)
+        self.send(listener, b"one", b"two", b"three")
+        self.assertListEqual(listener.drain(), [b"one", b"two"])
+        self.assertListEqual(listener.drain(), [b"three"])
+        self.assertListEqual(listener.drain(), [])
+
+    @gen_test
+    def test_process_batch(self):
+        listener, indexer = self.make_listener()
+        yield listener.process_batch([b"My name is Yuri and I'm 6 years old.\n",
+                                      b"A random line"])
+        self.assertEqual(listener.parsed, 1)
+        self.assertDictEqualWithTimestamp(
+            indexer.indexed[0],
+            {'name': 'Yuri', 'age': 6, '@version': 1,
+             'message': "My name is Yuri and I'm 6 years old."})
+        self.assertDictEqualWithTimestamp(
+            indexer.indexed[1], {'message': 'A random line', '@version': 1})
+
+    @gen_test
+    def test_receive(self):
+        listener, indexer = self.make_listener()
+        self.send(listener, b"first", b"second")
+        for _ in range(20):
+            if len(indexer.indexed) == 2:
+                break
+            yield gen.sleep(0.01)
+        self.assertEqual(listener.received, 2)
+        self.assertListEqual([doc['message'] for doc in indexer.indexed],
+                             ['first', 'second'])
+
+    def test_kernel_drops(self):
+        listener, _ = self.make_listener()
+        drops = kernel_drops(listener.socket)
+        self.assertIn(drops, (0, None))
@@ -0,0 +1,140 @@
+"""Setting @timestamp from a timestamp parsed out of the log line. As
+this has to be fast, the strptime format that worked last for a field
+is tried first, and parsed timestamps are cached to the second, so
+that only the fractional part is handled for timestamps that differ
+from the previous ones by less than a second."""
+import logging
+from datetime import datetime, timezone
+
+import regex
+
+logger = logging.getLogger(__name__)
+
+#Tried in order if no formats are configured. Fractions of seconds are
+#handled separately, so none of these have %f
+AUTO_FORMATS = [
+    '%Y-%m-%dT%H:%M:%S%z',
+    '%Y-%m-%dT%H:%M:%S',
+    '%Y-%m-%d %H:%M:%S%z',
+    '%Y-%m-%d %H:%M:%S',
+    '%d/%b/%Y:%H:%M:%S %z',
+    '%b %d %H:%M:%S',
+    '%Y/%m/%d %H:%M:%S',
+    '%a %b %d %H:%M:%S %Y',
+    '%d-%b-%Y %H:%M:%S',
+    '%d.%m.%Y %H:%M:%S',
+    'UNIX',
+    'UNIX_MS',
+]
+FRACTION_RE = regex.compile(r'(?<=:\d\d)[.,](\d+)')
+MAX_CACHE_SIZE = 10000
+
+
+def _parse_unix(value, divisor):
+    return datetime.fromtimestamp(float(value) / divisor, tz=timezone.utc)
+
+SPECIAL_FORMATS = {'UNIX': lambda value: _parse_unix(value, 1),
+                   'UNIX_MS': lambda value: _parse_unix(value, 1000)}
+
+
+def _without_fraction(fmt):
+    return fmt.replace('.%f', '').replace(',%f', '')
+
+
+def _current_year():
+    return datetime.utcnow().year
+
+
+class TimestampParser:
+    """Parses the timestamps of a single field"""
+
+    __slots__ = ('formats', 'current', 'cache')
+
+    def __init__(self, formats=None):
+        self.formats = [_without_fraction(fmt) for fmt in (formats or AUTO_FORMATS)]
+        self.current = None
+        self.cache = {}
+
+    def _strptime(self, value, fmt):
+        special = SPECIAL_FORMATS.get(fmt)
+        if special is not None:
+            return special(value)
+        if '%Y' not in fmt and '%y' not in fmt:
+            #the year is added before parsing, as strptime would otherwise
+            #use 1900, in which Feb 29 does not exist
+            return datetime.strptime('{} {}'.format(_current_year(), value), '%Y ' + fmt)
+        return datetime.strptime(value, fmt)
+
+    def _parse_seconds(self, value):
+        """Parse a timestamp without fractional seconds into the ISO8601
+        date and time, and the UTC offset"""
+        formats = self.formats
+        if self.current is not None:
+            formats = [self.current] + [fmt for fmt in formats if fmt != self.current]
+        for fmt in formats:
+            try:
+                parsed = self._strptime(value, fmt)
+            except (ValueError, OverflowError):
+                continue
+            if fmt != self.current:
+                logger.debug("Using timestamp format %s", fmt)
+                self.current = fmt
+            offset = parsed.strftime('%z') if parsed.tzinfo is not None else ''
+            offset = offset[:3] + ':' + offset[3:] if offset else '+00:00'
+            date_time = parsed.strftime('%Y-%m-%dT%H:%M:%S')
+            if parsed.microsecond:
+                date_time += '.{:06d}'.format(parsed.microsecond)
+            return date_time, offset
+        return None
+
+    def __call__(self, value):
+        """Return value as an ISO8601 timestamp, or None if it could not be
+        parsed with any of the formats"""
+        if not isinstance(value, str):
+            value = str(value)
+        fraction = None
+        match = FRACTION_RE.search(value)
+        if match is not None:
+            fraction = match.group(1)
+            value = value[:match.start()] + value[match.end():]
+        seconds = self.cache.get(value)
+        if seconds is None:
+            seconds = self._parse_seconds(value)
+            if seconds is None:
+                return None
+            if len(self.cache) >= MAX_CACHE_SIZE:
+                self.cache.clear()
+            self.cache[value] = seconds
+        date_time, offset = seconds
+        if fraction:
+            return '{}.{}{}'.format(date_time, fraction[:6].ljust(6, '0'), offset)
+        return date_time + offset
+
+
+class TimestampStage:
+    """Sets @timestamp of documents from the first of the configured
+    fields that can be parsed"""
+
+    def __init__(self, config):
+        fields = config.get('field', config.get('fields', 'timestamp'))
+        if isinstance(fields, str):
+            fields = [fields]
+        self.remove_field = config.get('remove_field', False)
+        formats = config.get('formats')
+        self.parsers = [(field, TimestampParser(formats)) for field in fields]
+        self.failed = 0
+
+    def __call__(self, doc):
+        for field, parser in self.parsers:
+            value = doc.get(field)
+            if value is None:
+                continue
+            timestamp = parser(value)
+            if timestamp is None:
+                self.failed += 1
+                continue
+            doc['@timestamp'] = timestamp
+            if self.remove_field:
+                del doc[field]
+            return doc
+        return doc
@@ -0,0 +1,152 @@
+"""UDP input, mostly for devices that can only send syslog over UDP.
+Every datagram is treated as a single log line."""
+import os
+import socket
+import logging
+
+from tornado import gen
+import tornado.ioloop
+
+from .processor import make_document
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_UDP_PORT = 5514
+DEFAULT_RCVBUF = 8 * 1024 * 1024
+DEFAULT_BATCH_SIZE = 256
+DEFAULT_MAX_PENDING_BATCHES = 16
+DEFAULT_REPORT_INTERVAL = 60
+MAX_DATAGRAM_SIZE = 65535
+
+
+def kernel_drops(sock):
+    """Return the number of datagrams the kernel dropped for sock because
+    its receive buffer was full, or None if this cannot be determined."""
+    inode = os.fstat(sock.fileno()).st_ino
+    for path in ('/proc/net/udp', '/proc/net/udp6'):
+        try:
+            with open(path, 'r') as proc_file:
+                next(proc_file)
+                for line in proc_file:
+                    fields = line.split()
+                    if int(fields[9]) == inode:
+                        return int(fields[-1])
+        except (OSError, ValueError, IndexError, StopIteration):
+            continue
+    return None
+
+
+class UDPListener:
+
+    def __init__(self, config, indexer, line_processor, io_loop=None, syslog_header=False,
+                 stages=(), shedder=None):
+        self.port = config.get('port', DEFAULT_UDP_PORT)
+        self.address = config.get('address', '')
+        self.rcvbuf = config.get('rcvbuf', DEFAULT_RCVBUF)
+        self.batch_size = config.get('batch_size', DEFAULT_BATCH_SIZE)
+        self.max_pending_batches = config.get('max_pending_batches',
+                                              DEFAULT_MAX_PENDING_BATCHES)
+        self.report_interval = config.get('report_interval', DEFAULT_REPORT_INTERVAL)
+        self.indexer = indexer
+        self.line_processor = line_processor
+        self.syslog_header = syslog_header
+        self.stages = stages
+        self.shedder = shedder
+        self.io_loop = io_loop or tornado.ioloop.IOLoop.current()
+        self.socket = None
+        self.reporter = None
+        self.reading = False
+        self.pending_batches = 0
+        self.received = 0
+        self.parsed = 0
+
+    def listen(self):
+        family = socket.AF_INET6 if ':' in self.address else socket.AF_INET
+        sock = socket.socket(family, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.rcvbuf)
+        actual_rcvbuf = sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+        if actual_rcvbuf < self.rcvbuf:
+            logger.warning("Requested UDP receive buffer of %d bytes, got %d; "
+                           "check net.core.rmem_max", self.rcvbuf, actual_rcvbuf)
+        sock.setblocking(False)
+        sock.bind((self.address, self.port))
+        self.socket = sock
+        self._start_reading()
+        self.reporter = tornado.ioloop.PeriodicCallback(
+            self.report, self.report_interval * 1000)
+        self.reporter.start()
+        logger.info("Accepting UDP datagrams on %s:%d", self.address or '*', self.port)
+
+    def stop(self):
+        if self.reporter is not None:
+            self.reporter.stop()
+        if self.socket is not None:
+            self._stop_reading()
+            self.socket.close()
+            self.socket = None
+
+    def _start_reading(self):
+        if not self.reading:
+            self.io_loop.add_handler(self.socket.fileno(), self._on_readable,
+                                     tornado.ioloop.IOLoop.READ)
+            self.reading = True
+
+    def _stop_reading(self):
+        if self.reading:
+            self.io_loop.remove_handler(self.socket.fileno())
+            self.reading = False
+
+    def drain(self):
+        """Read up to batch_size datagrams without blocking"""
+        batch = []
+        recvfrom = self.socket.recvfrom
+        for _ in range(self.batch_size):
+            try:
+                data, _address = recvfrom(MAX_DATAGRAM_SIZE)
+            except (BlockingIOError, InterruptedError):
+                break
+            batch.append(data)
+        return batch
+
+    def _on_readable(self, fd, events):
+        batch = self.drain()
+        if not batch:
+            return
+        self.received += len(batch)
+        self.pending_batches += 1
+        if self.pending_batches >= self.max_pending_batches:
+            #leave the datagrams in the kernel buffer until we catch up
+            self._stop_reading()
+        self.io_loop.add_future(gen.convert_yielded(self.process_batch(batch)),
+                                self._batch_done)
+
+    def _batch_done(self, future):
+        self.pending_batches -= 1
+        if future.exception() is not None:
+            logger.error("Error processing UDP batch: %s", future.exception())
+        if self.socket is not None and self.pending_batches < self.max_pending_batches:
+            self._start_reading()
+
+    async def process_batch(self, batch):
+        docs = []
+        for data in batch:
+            line = data.decode('utf-8', errors='replace').rstrip('\n\x00')
+            doc, parsed = make_document(self.line_processor, line,
+                                        syslog_header=self.syslog_header,
+                                        stages=self.stages)
+            if parsed:
+                self.parsed += 1
+            if self.shedder is not None and not self.shedder.admit(doc, parsed):
+                continue
+            docs.append(doc)
+        if self.shedder is None:
+            await gen.multi([self.indexer.index(doc) for doc in docs])
+        else:
+            await gen.multi([self.shedder.track(self.indexer.index(doc)) for doc in docs])
+
+    def report(self):
+        drops = kernel_drops(self.socket) if self.socket is not None else None
+        logger.info("Received %d UDP datagrams, parsed %d, dropped by kernel: %s",
+                    self.received, self.parsed,
+                    'unknown' if drops is None else drops)